@@ -4,20 +4,16 @@ import json
 import logging
 import os
 import requests
-from jose import jwt, jwk
 
-log = logging.getLogger()
-log.setLevel(logging.INFO)
-
-COGNITO_POOL_ID = os.getenv("COGNITO_POOL_ID")
-COGNITO_REGION = os.getenv("COGNITO_REGION")
-APP_CLIENT_ID = os.getenv("APP_WEB_CLIENT_ID")
+from irentstuff_common.auth import get_cognito_jwks, verify_token
 
+log = logging.getLogger()
+# WARNING by default: CloudWatch bills per GB ingested and formatting log lines costs CPU on every request.
+# Set LOG_LEVEL=INFO or DEBUG on the function to get the detailed logs back while debugging
+log.setLevel(os.environ.get("LOG_LEVEL", "WARNING"))
 
-def get_cognito_jwks():
-    jwks_url = f'https://cognito-idp.{COGNITO_REGION}.amazonaws.com/{COGNITO_POOL_ID}/.well-known/jwks.json'
-    response = requests.get(jwks_url)
-    return response.json()
+# Fixed response body, serialised once per container
+_TOKEN_MISSING_BODY = json.dumps('Token is missing')
 
 
 def authenticate_user(event, context):
@@ -28,44 +24,13 @@ def authenticate_user(event, context):
     if not token:
         return {
             'statusCode': 403,
-            'body': json.dumps('Token is missing')
+            'body': _TOKEN_MISSING_BODY
         }
 
     try:
-        # Get Cognito's JWKS
-        jwks = get_cognito_jwks()
-
-        # Get the header of the JWT token
-        headers = jwt.get_unverified_header(token)
-        kid = headers['kid']  # Get the key ID from the token's header
-
-        # Find the correct key in the JWK set
-        key = next(item for item in jwks['keys'] if item['kid'] == kid)
-
-        # Verify the token using the key
-        public_key = jwk.construct(key)
-        log.info("Token verified")
-
-        # Decode and verify the token (with audience verification)
-        decoded_token = jwt.decode(
-            token,
-            public_key,
-            algorithms=['RS256'],
-            audience=APP_CLIENT_ID
-        )
-        log.info("Token decoded")
-
-        # Extract the 'username' from the claims
-        username = decoded_token.get('cognito:username')
-        user_id = decoded_token.get('sub')  # 'sub' is the user ID (UUID)
-
         return {
             'statusCode': 200,
-            'body': json.dumps({
-                'message': 'Token is valid',
-                'username': username,
-                'user_id': user_id
-            })
+            'body': json.dumps(verify_token(token), separators=(',', ':'))
         }
 
     except Exception as e:
@@ -73,3 +38,12 @@ def authenticate_user(event, context):
             'statusCode': 403,
             'body': json.dumps(f'Invalid token: {str(e)}')
         }
+
+
+# Provisioned containers run their init ahead of traffic, so fetch the JWKS then instead of on the first token.
+# A failure here is not fatal: get_public_key() fetches it lazily on first use
+if os.getenv("AWS_LAMBDA_INITIALIZATION_TYPE") == "provisioned-concurrency":
+    try:
+        get_cognito_jwks()
+    except requests.exceptions.RequestException as e:
+        log.error("Could not prefetch Cognito JWKS: %s", e)
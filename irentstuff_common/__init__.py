@@ -0,0 +1 @@
+"""Code shared by the iRentStuff transaction Lambdas. Deployed to them as the irentstuff-common Lambda layer"""
@@ -0,0 +1,101 @@
+"""Cognito JWT verification"""
+
+import hashlib
+import logging
+import os
+import time
+
+from collections import OrderedDict
+from irentstuff_common.session import SESSION
+from jose import jwt, jwk
+
+log = logging.getLogger()
+
+COGNITO_POOL_ID = os.getenv("COGNITO_POOL_ID")
+COGNITO_REGION = os.getenv("COGNITO_REGION")
+APP_CLIENT_ID = os.getenv("APP_WEB_CLIENT_ID")
+
+# Cognito rotates its signing keys on the order of days, so the JWKS is fetched once and reused across warm invocations.
+# It is refetched after an hour so a key Cognito has withdrawn stops being accepted by long-lived containers
+_JWKS_TTL = 3600.0
+_JWKS_CACHE = None
+_JWKS_FETCHED_AT = 0.0
+_JWKS_BY_KID = {}
+# A token with an unknown kid forces a refetch, so anyone could make every request hit Cognito by sending made-up kids.
+# Rotated keys are published well before use, so refetching at most once a minute is enough to pick them up
+_JWKS_MIN_REFRESH_INTERVAL = 60.0
+
+# Clients send the same token on every call until it expires, so a verified token is remembered for a short while and
+# the RSA signature check is skipped on repeats. Bounded LRU keyed by a SHA-256 of the token (the token itself is a
+# credential), holding (verified_at, exp, identity) triples
+_TOKEN_CACHE_TTL = 30.0
+_TOKEN_CACHE_SIZE = 1024
+_TOKEN_CACHE = OrderedDict()
+
+
+def get_cognito_jwks(refresh=False):
+    global _JWKS_CACHE, _JWKS_FETCHED_AT, _JWKS_BY_KID
+    if _JWKS_CACHE is None or refresh or time.monotonic() - _JWKS_FETCHED_AT >= _JWKS_TTL:
+        jwks_url = f'https://cognito-idp.{COGNITO_REGION}.amazonaws.com/{COGNITO_POOL_ID}/.well-known/jwks.json'
+        response = SESSION.get(jwks_url, timeout=3)
+        _JWKS_CACHE = response.json()
+        _JWKS_FETCHED_AT = time.monotonic()
+        _JWKS_BY_KID = {k['kid']: jwk.construct(k) for k in _JWKS_CACHE['keys']}
+    return _JWKS_CACHE
+
+
+def get_public_key(kid):
+    """Look up the signing key for kid, refreshing the cached JWKS once in case Cognito has rotated its keys.
+    Raises KeyError without refetching if the JWKS was fetched less than _JWKS_MIN_REFRESH_INTERVAL ago"""
+    get_cognito_jwks()
+    try:
+        return _JWKS_BY_KID[kid]
+    except KeyError:
+        if time.monotonic() - _JWKS_FETCHED_AT < _JWKS_MIN_REFRESH_INTERVAL:
+            log.warning("Key %s not in JWKS fetched under %ds ago, rejecting", kid, _JWKS_MIN_REFRESH_INTERVAL)
+            raise
+        log.info("Key %s not in cached JWKS, refreshing", kid)
+        get_cognito_jwks(refresh=True)
+        return _JWKS_BY_KID[kid]
+
+
+def verify_token(token):
+    """Verifies a Cognito JWT and returns the identity it belongs to. Raises if the token is invalid.
+    Used by the authenticate user Lambda, and directly by the add and update purchase/rental Lambdas so they don't have to invoke it"""
+    token_hash = hashlib.sha256(token.encode()).hexdigest()
+    cached = _TOKEN_CACHE.get(token_hash)
+    if cached and time.monotonic() - cached[0] < _TOKEN_CACHE_TTL and time.time() < cached[1]:
+        _TOKEN_CACHE.move_to_end(token_hash)
+        return cached[2]
+
+    # Get the header of the JWT token
+    headers = jwt.get_unverified_header(token)
+    kid = headers['kid']  # Get the key ID from the token's header
+
+    # Find the correct key in the cached JWK set
+    public_key = get_public_key(kid)
+    log.info("Token verified")
+
+    # Decode and verify the token (with audience verification)
+    decoded_token = jwt.decode(
+        token,
+        public_key,
+        algorithms=['RS256'],
+        audience=APP_CLIENT_ID
+    )
+    log.info("Token decoded")
+
+    # Extract the 'username' from the claims
+    username = decoded_token.get('cognito:username')
+    user_id = decoded_token.get('sub')  # 'sub' is the user ID (UUID)
+
+    identity = {
+        'message': 'Token is valid',
+        'username': username,
+        'user_id': user_id
+    }
+    _TOKEN_CACHE[token_hash] = (time.monotonic(), decoded_token.get('exp', 0), identity)
+    _TOKEN_CACHE.move_to_end(token_hash)
+    if len(_TOKEN_CACHE) > _TOKEN_CACHE_SIZE:
+        _TOKEN_CACHE.popitem(last=False)
+    return identity
@@ -0,0 +1,80 @@
+"""Connection to the Transactions DB, through RDS Proxy"""
+
+import logging
+import os
+import pymysql
+import sys
+
+log = logging.getLogger()
+
+# pymysql rather than the mysqlclient C extension: mysqlclient needs libmysqlclient built for Amazon Linux shipped in a layer,
+# and its ping() cannot reconnect, which get_conn() relies on. Our queries return a handful of rows, so the
+# pure-Python protocol overhead is small next to the RDS Proxy round trip
+
+# autocommit: every handler runs single statements, so an explicit COMMIT is just another round trip. It also stops a
+# SELECT on the cached connection from pinning a REPEATABLE READ snapshot that later warm invocations would read from
+
+# Kept at module scope so warm invocations skip the TCP/TLS/MySQL handshake against RDS Proxy
+_transactions_conn = None
+
+_SQL_SELECT_INDEX_NAMES = "SELECT DISTINCT index_name FROM information_schema.statistics WHERE table_schema = DATABASE() AND table_name = %s"
+# ER_DUP_KEYNAME: another container created the index between our check and our CREATE INDEX
+_ER_DUP_KEYNAME = 1061
+
+
+def connect_to_db():
+    "Connect to Transactions DB"
+    transactions_conn = None
+    transactions_db_user_name = os.environ["DB1_USER_NAME"]
+    transactions_db_password = os.environ["DB1_PASSWORD"]
+    transactions_db_rds_proxy_host = os.environ["DB1_RDS_PROXY_HOST"]
+    transactions_db_name = os.environ["DB1_NAME"]
+
+    try:
+        transactions_conn = pymysql.connect(
+            host=transactions_db_rds_proxy_host,
+            user=transactions_db_user_name,
+            passwd=transactions_db_password,
+            db=transactions_db_name,
+            connect_timeout=5,
+            read_timeout=5,
+            write_timeout=5,
+            autocommit=True)
+        log.info("SUCCESS: Connection to Transactions DB succeeded")
+    except pymysql.MySQLError as e:
+        log.error("ERROR: Unexpected error: Could not connect to MySQL instance.")
+        log.error(e)
+        sys.exit(1)
+    return transactions_conn
+
+
+def get_conn():
+    "Return the Transactions DB connection, reusing the one opened by a previous warm invocation"
+    global _transactions_conn
+    if _transactions_conn is None:
+        _transactions_conn = connect_to_db()
+    else:
+        try:
+            _transactions_conn.ping(reconnect=True)
+        except pymysql.MySQLError as e:
+            log.error("Cached connection to Transactions DB is stale, reconnecting: %s", e)
+            _transactions_conn = connect_to_db()
+    return _transactions_conn
+
+
+def ensure_indexes(cursor, table, indexes):
+    """Run the CREATE INDEX statement in indexes ({index name: statement}) for each index table doesn't have yet.
+    CREATE TABLE IF NOT EXISTS leaves an existing table untouched, so indexes added to the DDL later only reach tables
+    created after them without this. Failures are logged rather than raised: a missing index costs speed, not correctness"""
+    cursor.execute(_SQL_SELECT_INDEX_NAMES, (table,))
+    existing = {row[0] for row in cursor.fetchall()}
+    for name, statement in indexes.items():
+        if name in existing:
+            continue
+        log.warning("Index %s is missing on %s, creating it", name, table)
+        try:
+            cursor.execute(statement)
+        except pymysql.MySQLError as e:
+            if e.args and e.args[0] == _ER_DUP_KEYNAME:
+                continue
+            log.error("Could not create index %s on %s: %s", name, table, e)
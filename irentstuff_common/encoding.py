@@ -0,0 +1,21 @@
+"""JSON encoding of the rows pymysql returns, for the response bodies of the transaction Lambdas"""
+
+import json
+
+from datetime import date, datetime
+from decimal import Decimal
+
+
+class RowEncoder(json.JSONEncoder):
+    "Formats the DATETIME/DATE/DECIMAL values pymysql returns as ISO strings and floats while the row is serialised"
+
+    def default(self, o):
+        if isinstance(o, (datetime, date)):
+            return o.isoformat()
+        if isinstance(o, Decimal):
+            return float(o)
+        return super().default(o)
+
+
+# Built once per container rather than per json.dumps(cls=...) call
+ROW_ENCODER = RowEncoder(separators=(",", ":"))
@@ -0,0 +1,20 @@
+"""Response headers for the API Gateway endpoints in front of the transaction Lambdas"""
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, PATCH, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type'
+}
+# Built once per container; callers only read these, so every response can share the same dicts
+JSON_HEADERS = {**CORS_HEADERS, 'Content-Type': 'application/json'}
+TEXT_HEADERS = {**CORS_HEADERS, 'Content-Type': 'text/plain'}
+
+# Any other content type gets its dict built on first use. Content types come from our own code, so this stays small
+_HEADERS_BY_CONTENT_TYPE = {'application/json': JSON_HEADERS, 'text/plain': TEXT_HEADERS}
+
+
+def response_headers(content_type: str):
+    headers = _HEADERS_BY_CONTENT_TYPE.get(content_type)
+    if headers is None:
+        headers = _HEADERS_BY_CONTENT_TYPE[content_type] = {**CORS_HEADERS, 'Content-Type': content_type}
+    return headers
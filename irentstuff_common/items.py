@@ -0,0 +1,56 @@
+"""Client for the items API, which owns each item's details and availability"""
+
+import os
+import requests
+import time
+
+from collections import OrderedDict
+from irentstuff_common.headers import TEXT_HEADERS
+from irentstuff_common.session import SESSION
+
+# Item metadata rarely changes between a user's retries and double-clicks, so reuse what the items API returned for a
+# couple of seconds. Bounded LRU keyed by item_id, holding (fetched_at, item) pairs.
+# Availability changes made by other containers are only seen once an entry expires, so ITEM_CACHE_TTL should stay
+# short; it can be raised on a function whose items change rarely
+_ITEM_CACHE_TTL = float(os.environ.get("ITEM_CACHE_TTL", "2"))
+_ITEM_CACHE_SIZE = 256
+_ITEM_CACHE = OrderedDict()
+
+
+def get_item(item_id):
+    """Gets item details from the item DB via API"""
+
+    cached = _ITEM_CACHE.get(item_id)
+    if cached and time.monotonic() - cached[0] < _ITEM_CACHE_TTL:
+        _ITEM_CACHE.move_to_end(item_id)
+        return cached[1]
+
+    api_url = f"https://pxgwc7gdz1.execute-api.ap-southeast-1.amazonaws.com/dev/items/{item_id}"
+
+    try:
+        response = SESSION.get(api_url, timeout=3)
+
+        if response.status_code == 200:
+            item = response.json()
+            _ITEM_CACHE[item_id] = (time.monotonic(), item)
+            _ITEM_CACHE.move_to_end(item_id)
+            if len(_ITEM_CACHE) > _ITEM_CACHE_SIZE:
+                _ITEM_CACHE.popitem(last=False)
+            return item
+        else:
+            return {
+                "status_code": response.status_code,
+                "body": response.text
+            }
+
+    except requests.exceptions.RequestException as e:
+        return {
+            "status_code": 500,
+            "headers": TEXT_HEADERS,
+            "body": f"Error occurred while making API call: {str(e)}"
+        }
+
+
+def invalidate_item(item_id):
+    "Forget the cached details for item_id, e.g. after a transaction has changed its availability"
+    _ITEM_CACHE.pop(item_id, None)
@@ -0,0 +1,9 @@
+"""HTTP session used for every outbound HTTPS call made from the layer"""
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Shared across warm invocations so HTTPS calls reuse a pooled keep-alive connection instead of a fresh TLS handshake
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+SESSION.headers.update({'Connection': 'keep-alive'})
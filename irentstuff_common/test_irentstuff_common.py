@@ -0,0 +1,404 @@
+import json
+import os
+import pymysql
+import pytest
+import requests
+import time
+
+from datetime import date, datetime
+from decimal import Decimal
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+
+from irentstuff_common import auth, db, items, session
+from irentstuff_common.auth import get_cognito_jwks, get_public_key, verify_token
+from irentstuff_common.db import connect_to_db, ensure_indexes, get_conn
+from irentstuff_common.encoding import ROW_ENCODER
+from irentstuff_common.headers import JSON_HEADERS, response_headers
+from irentstuff_common.items import get_item, invalidate_item
+
+
+class TestConnectToDB(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Set up environment variables for testing
+        os.environ["DB1_USER_NAME"] = "test_user"
+        os.environ["DB1_PASSWORD"] = "test_password"
+        os.environ["DB1_RDS_PROXY_HOST"] = "test_host"
+        os.environ["DB1_NAME"] = "test_db"
+
+    @patch("pymysql.connect")
+    def test_connect_to_db_success(self, mock_connect):
+        # Mock the connection object
+        mock_conn = MagicMock()
+        mock_connect.return_value = mock_conn
+
+        # Call the function
+        result = connect_to_db()
+
+        # Assert that the connect function was called with the expected arguments
+        mock_connect.assert_called_once_with(
+            host=os.environ["DB1_RDS_PROXY_HOST"],
+            user=os.environ["DB1_USER_NAME"],
+            passwd=os.environ["DB1_PASSWORD"],
+            db=os.environ["DB1_NAME"],
+            connect_timeout=5,
+            read_timeout=5,
+            write_timeout=5,
+            autocommit=True
+        )
+
+        # Assert that the returned connection is the mocked connection
+        self.assertEqual(result, mock_conn)
+
+    @patch("pymysql.connect")
+    @patch("sys.exit")  # Mock sys.exit to prevent the script from exiting
+    def test_connect_to_db_failure(self, mock_exit, mock_connect):
+        # Simulate a MySQL error when trying to connect
+        mock_connect.side_effect = pymysql.MySQLError("Connection error")
+
+        # Call the function (no need to expect SystemExit since we're mocking sys.exit)
+        connect_to_db()
+
+        # Assert that sys.exit was called with the correct exit code
+        mock_exit.assert_called_once_with(1)
+
+
+class TestGetConn(TestCase):
+    def setUp(self):
+        # Drop any connection cached at module scope by a previous test
+        db._transactions_conn = None
+
+    @patch("irentstuff_common.db.connect_to_db")
+    def test_get_conn_reuses_cached_connection(self, mock_connect):
+        mock_conn = MagicMock()
+        mock_connect.return_value = mock_conn
+
+        # First call connects, second call reuses the cached connection
+        self.assertEqual(get_conn(), mock_conn)
+        self.assertEqual(get_conn(), mock_conn)
+
+        mock_connect.assert_called_once()
+        mock_conn.ping.assert_called_once_with(reconnect=True)
+
+    @patch("irentstuff_common.db.connect_to_db")
+    def test_get_conn_reconnects_stale_connection(self, mock_connect):
+        stale_conn = MagicMock()
+        stale_conn.ping.side_effect = pymysql.MySQLError("Lost connection")
+        fresh_conn = MagicMock()
+        mock_connect.return_value = fresh_conn
+        db._transactions_conn = stale_conn
+
+        self.assertEqual(get_conn(), fresh_conn)
+        mock_connect.assert_called_once()
+
+
+class TestEnsureIndexes:
+    INDEXES = {
+        "idx_t_a": "CREATE INDEX idx_t_a ON T (a)",
+        "idx_t_b": "CREATE INDEX idx_t_b ON T (b)",
+    }
+
+    def test_ensure_indexes_creates_only_missing_ones(self):
+        mock_cursor = MagicMock()
+        mock_cursor.fetchall.return_value = [("PRIMARY",), ("idx_t_a",)]
+
+        ensure_indexes(mock_cursor, "T", self.INDEXES)
+
+        assert mock_cursor.execute.call_args_list[0].args[1] == ("T",)
+        mock_cursor.execute.assert_called_with("CREATE INDEX idx_t_b ON T (b)")
+        assert mock_cursor.execute.call_count == 2
+
+    def test_ensure_indexes_tolerates_a_concurrent_create(self):
+        mock_cursor = MagicMock()
+        mock_cursor.fetchall.return_value = []
+        # The first CREATE INDEX loses a race with another container, the second fails outright; neither is raised
+        mock_cursor.execute.side_effect = [
+            None,
+            pymysql.err.OperationalError(1061, "Duplicate key name 'idx_t_a'"),
+            pymysql.err.OperationalError(1205, "Lock wait timeout exceeded"),
+        ]
+
+        ensure_indexes(mock_cursor, "T", self.INDEXES)
+
+        assert mock_cursor.execute.call_count == 3
+
+
+class TestResponseHeaders:
+    def test_response_headers(self):
+        # Test case for when content_type is 'application/json'
+        content_type = "application/json"
+        expected_headers = {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': 'GET, POST, PATCH, OPTIONS',
+            'Access-Control-Allow-Headers': 'Content-Type',
+            'Content-Type': content_type
+        }
+
+        result = response_headers(content_type)
+        assert result == expected_headers
+        assert result['Content-Type'] == 'application/json'
+
+    def test_response_headers_text(self):
+        # Test case for when content_type is 'text/html'
+        content_type = "text/html"
+        expected_headers = {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': 'GET, POST, PATCH, OPTIONS',
+            'Access-Control-Allow-Headers': 'Content-Type',
+            'Content-Type': content_type
+        }
+
+        result = response_headers(content_type)
+        assert result == expected_headers
+        assert result['Content-Type'] == 'text/html'
+
+    def test_response_headers_reuses_dict_per_content_type(self):
+        assert response_headers("application/json") is JSON_HEADERS
+        assert response_headers("text/csv") is response_headers("text/csv")
+
+
+class TestRowEncoder:
+    def test_row_encoder_formats_dates_and_decimals(self):
+        row = {"created_at": datetime(2023, 10, 1, 12, 30), "purchase_date": date(2023, 10, 1), "purchase_price": Decimal("99.99")}
+
+        assert json.loads(ROW_ENCODER.encode(row)) == {
+            "created_at": "2023-10-01T12:30:00", "purchase_date": "2023-10-01", "purchase_price": 99.99
+        }
+
+    def test_row_encoder_rejects_other_types(self):
+        with pytest.raises(TypeError):
+            ROW_ENCODER.encode({"value": object()})
+
+
+class TestGetItem:
+    def setup_method(self):
+        # Drop any items cached at module scope by a previous test
+        items._ITEM_CACHE.clear()
+
+    @patch("irentstuff_common.items.SESSION.get")
+    def test_get_item_success(self, mock_get):
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {"item_id": "123", "name": "Test Item"}
+        mock_get.return_value = mock_response
+
+        result = get_item("123")
+
+        mock_get.assert_called_once_with("https://pxgwc7gdz1.execute-api.ap-southeast-1.amazonaws.com/dev/items/123", timeout=3)
+        assert result == {"item_id": "123", "name": "Test Item"}
+
+    @patch("irentstuff_common.items.SESSION.get")
+    def test_get_item_failure(self, mock_get):
+        mock_response = MagicMock()
+        mock_response.status_code = 404
+        mock_response.text = "Item not found"
+        mock_get.return_value = mock_response
+
+        result = get_item("123")
+
+        mock_get.assert_called_once_with("https://pxgwc7gdz1.execute-api.ap-southeast-1.amazonaws.com/dev/items/123", timeout=3)
+        assert result == {"status_code": 404, "body": "Item not found"}
+
+    @patch("irentstuff_common.items.SESSION.get")
+    def test_get_item_exception(self, mock_get):
+        mock_get.side_effect = requests.exceptions.RequestException("API failure")
+
+        result = get_item("123")
+
+        mock_get.assert_called_once_with("https://pxgwc7gdz1.execute-api.ap-southeast-1.amazonaws.com/dev/items/123", timeout=3)
+        assert result == {
+            "status_code": 500,
+            "headers": response_headers('text/plain'),
+            "body": "Error occurred while making API call: API failure"
+        }
+
+    @patch("irentstuff_common.items.time.monotonic")
+    @patch("irentstuff_common.items.SESSION.get")
+    def test_get_item_serves_repeat_calls_from_cache(self, mock_get, mock_monotonic):
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {"item_id": "123", "name": "Test Item"}
+        mock_get.return_value = mock_response
+
+        mock_monotonic.return_value = 100.0
+        first = get_item("123")
+        mock_monotonic.return_value = 101.0
+        second = get_item("123")
+
+        mock_get.assert_called_once()
+        assert first == second == {"item_id": "123", "name": "Test Item"}
+
+    @patch("irentstuff_common.items.time.monotonic")
+    @patch("irentstuff_common.items.SESSION.get")
+    def test_get_item_refetches_after_ttl(self, mock_get, mock_monotonic):
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {"item_id": "123", "name": "Test Item"}
+        mock_get.return_value = mock_response
+
+        mock_monotonic.return_value = 100.0
+        get_item("123")
+        mock_monotonic.return_value = 103.0
+        get_item("123")
+
+        assert mock_get.call_count == 2
+
+    @patch("irentstuff_common.items.SESSION.get")
+    def test_get_item_does_not_cache_failures(self, mock_get):
+        mock_response = MagicMock()
+        mock_response.status_code = 404
+        mock_response.text = "Item not found"
+        mock_get.return_value = mock_response
+
+        get_item("123")
+        get_item("123")
+
+        assert mock_get.call_count == 2
+
+    @patch("irentstuff_common.items.SESSION.get")
+    def test_invalidate_item_forces_refetch(self, mock_get):
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {"item_id": "123", "name": "Test Item"}
+        mock_get.return_value = mock_response
+
+        get_item("123")
+        invalidate_item("123")
+        get_item("123")
+
+        assert mock_get.call_count == 2
+        invalidate_item("456")  # Unknown items are ignored
+
+
+class TestSession:
+    def test_items_and_auth_share_the_pooled_session(self):
+        # One keep-alive pool per container, so warm calls to the items API and Cognito skip the TLS handshake
+        assert items.SESSION is session.SESSION
+        assert auth.SESSION is session.SESSION
+        adapter = session.SESSION.get_adapter("https://pxgwc7gdz1.execute-api.ap-southeast-1.amazonaws.com")
+        assert adapter._pool_maxsize == 4
+
+
+class TestGetCognitoJwks:
+    def setup_method(self):
+        # Drop any JWKS cached at module scope by a previous test
+        auth._JWKS_CACHE = None
+        auth._JWKS_FETCHED_AT = 0.0
+        auth._JWKS_BY_KID = {}
+
+    @staticmethod
+    def jwks_response(*kids):
+        mock_response = MagicMock()
+        mock_response.json.return_value = {"keys": [{"kid": kid} for kid in kids]}
+        return mock_response
+
+    @patch("irentstuff_common.auth.jwk.construct", side_effect=lambda key: f"public-{key['kid']}")
+    @patch("irentstuff_common.auth.time.monotonic")
+    @patch("irentstuff_common.auth.SESSION.get")
+    def test_get_cognito_jwks_served_from_cache_when_warm(self, mock_get, mock_monotonic, mock_construct):
+        mock_get.return_value = self.jwks_response("kid1")
+
+        mock_monotonic.return_value = 100.0
+        first = get_cognito_jwks()
+        mock_monotonic.return_value = 200.0
+        second = get_cognito_jwks()
+
+        mock_get.assert_called_once()
+        assert first == second == {"keys": [{"kid": "kid1"}]}
+        assert get_public_key("kid1") == "public-kid1"
+
+    @patch("irentstuff_common.auth.jwk.construct", side_effect=lambda key: f"public-{key['kid']}")
+    @patch("irentstuff_common.auth.time.monotonic")
+    @patch("irentstuff_common.auth.SESSION.get")
+    def test_get_cognito_jwks_refetches_after_ttl(self, mock_get, mock_monotonic, mock_construct):
+        mock_get.return_value = self.jwks_response("kid1")
+
+        mock_monotonic.return_value = 100.0
+        get_cognito_jwks()
+        mock_monotonic.return_value = 100.0 + auth._JWKS_TTL
+        get_cognito_jwks()
+
+        assert mock_get.call_count == 2
+
+    @patch("irentstuff_common.auth.jwk.construct", side_effect=lambda key: f"public-{key['kid']}")
+    @patch("irentstuff_common.auth.time.monotonic")
+    @patch("irentstuff_common.auth.SESSION.get")
+    def test_get_public_key_refreshes_for_unknown_kid(self, mock_get, mock_monotonic, mock_construct):
+        mock_get.side_effect = [self.jwks_response("kid1"), self.jwks_response("kid1", "kid2")]
+
+        mock_monotonic.return_value = 100.0
+        get_cognito_jwks()
+        mock_monotonic.return_value = 100.0 + auth._JWKS_MIN_REFRESH_INTERVAL
+        assert get_public_key("kid2") == "public-kid2"
+        assert mock_get.call_count == 2
+
+    @patch("irentstuff_common.auth.jwk.construct", side_effect=lambda key: f"public-{key['kid']}")
+    @patch("irentstuff_common.auth.time.monotonic")
+    @patch("irentstuff_common.auth.SESSION.get")
+    def test_get_public_key_rejects_unknown_kid_without_refetching_again(self, mock_get, mock_monotonic, mock_construct):
+        mock_get.return_value = self.jwks_response("kid1")
+
+        mock_monotonic.return_value = 100.0
+        get_cognito_jwks()
+        # Still inside the refresh interval, so unknown kids are turned away instead of refetching the JWKS each time
+        mock_monotonic.return_value = 100.0 + auth._JWKS_MIN_REFRESH_INTERVAL - 1
+        for _ in range(3):
+            with pytest.raises(KeyError):
+                get_public_key("made-up-kid")
+
+        mock_get.assert_called_once()
+        assert get_public_key("kid1") == "public-kid1"
+
+
+class TestVerifyToken:
+    def setup_method(self):
+        # Drop any tokens cached at module scope by a previous test
+        auth._TOKEN_CACHE.clear()
+        # Every test here stubs the same two collaborators, so patch them once rather than stacking decorators per test
+        self.patchers = [patch("irentstuff_common.auth.jwt"), patch("irentstuff_common.auth.get_public_key")]
+        self.mock_jwt, self.mock_get_public_key = [p.start() for p in self.patchers]
+        self.mock_jwt.get_unverified_header.return_value = {"kid": "kid1"}
+
+    def teardown_method(self):
+        for p in self.patchers:
+            p.stop()
+
+    @staticmethod
+    def claims(exp):
+        return {"cognito:username": "user1", "sub": "uuid-1", "exp": exp}
+
+    def test_verify_token_success(self):
+        self.mock_jwt.decode.return_value = self.claims(time.time() + 3600)
+
+        assert verify_token("token") == {"message": "Token is valid", "username": "user1", "user_id": "uuid-1"}
+        self.mock_get_public_key.assert_called_once_with("kid1")
+
+    def test_verify_token_caches_repeat_tokens(self):
+        self.mock_jwt.decode.return_value = self.claims(time.time() + 3600)
+
+        first = verify_token("token")
+        second = verify_token("token")
+
+        assert first == second
+        self.mock_jwt.decode.assert_called_once()
+
+        verify_token("other-token")
+        assert self.mock_jwt.decode.call_count == 2
+
+    def test_verify_token_does_not_serve_expired_tokens_from_cache(self):
+        self.mock_jwt.decode.return_value = self.claims(time.time() - 1)
+
+        verify_token("token")
+        verify_token("token")
+
+        assert self.mock_jwt.decode.call_count == 2
+
+    def test_verify_token_does_not_cache_failures(self):
+        self.mock_jwt.decode.side_effect = Exception("Signature verification failed.")
+
+        for _ in range(2):
+            with pytest.raises(Exception, match="Signature verification failed."):
+                verify_token("token")
+
+        assert self.mock_jwt.decode.call_count == 2
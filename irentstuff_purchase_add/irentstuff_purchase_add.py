@@ -13,75 +13,75 @@ TODO
 If an item status is returned as "active_rental", the purchase request should not be allowed.
 """
 
-import boto3
 import json
 import logging
 import os
 import pymysql
-import requests
-import sys
 
-from datetime import datetime, date
-from websocket import create_connection
+from datetime import datetime
+from irentstuff_common.auth import verify_token
+from irentstuff_common.db import ensure_indexes, get_conn
+from irentstuff_common.headers import JSON_HEADERS, TEXT_HEADERS
+from irentstuff_common.items import get_item, invalidate_item
 
 log = logging.getLogger()
-log.setLevel(logging.INFO)
-
-lambda_client = boto3.client('lambda', region_name="ap-southeast-1")
-
-
-def invoke_auth_lambda(jwt_token):
-    # Prepare the payload to send to the authentication Lambda
-    payload = {
-        "headers": {
-            "Authorization": jwt_token
-        }
-    }
-
-    # Invoke the authentication Lambda function
-    response = lambda_client.invoke(
-        FunctionName='irentstuff-authenticate-user',  # Replace with the actual Lambda function name
-        InvocationType='RequestResponse',  # Synchronous invocation
-        Payload=json.dumps(payload)
+# WARNING by default: CloudWatch bills per GB ingested and formatting log lines costs CPU on every request.
+# Set LOG_LEVEL=INFO or DEBUG on the function to get the detailed logs back while debugging
+log.setLevel(os.environ.get("LOG_LEVEL", "WARNING"))
+
+# The tables only need creating once, so warm invocations skip the CREATE TABLE IF NOT EXISTS round trip
+_schema_ready = False
+
+# SQL is kept at module scope so statements are built once per container. They are deliberately not server-side
+# PREPAREd: RDS Proxy pins the client to one DB connection for the rest of the session once a statement is prepared
+_SQL_CREATE_PURCHASES_TABLE = """
+    CREATE TABLE IF NOT EXISTS Purchases (
+        purchase_id INT AUTO_INCREMENT PRIMARY KEY,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        owner_id VARCHAR(255) NOT NULL,
+        buyer_id VARCHAR(255) NOT NULL,
+        item_id INT NOT NULL,
+        purchase_date DATE NULL,
+        status VARCHAR(255) NOT NULL,
+        purchase_price DECIMAL(10, 2) NOT NULL,
+        INDEX idx_purchases_owner_id (owner_id),
+        INDEX idx_purchases_buyer_id (buyer_id)
     )
+"""
 
-    # Read the response from the invoked function
-    response_payload = json.loads(response['Payload'].read())
-    log.info(response_payload)
-
-    # Process the response based on the status code
-    if response['StatusCode'] == 200:
-        # The authentication Lambda responded successfully
-        return json.loads(response_payload.get('body'))
-    else:
-        # Handle the case where the authentication failed
-        raise Exception(f"Authentication failed: {response_payload.get('body')}")
-
-
-def connect_to_db():
-    "Connect to Transactions DB"
-    transactions_conn = None
-    transactions_db_user_name = os.environ["DB1_USER_NAME"]
-    transactions_db_password = os.environ["DB1_PASSWORD"]
-    transactions_db_rds_proxy_host = os.environ["DB1_RDS_PROXY_HOST"]
-    transactions_db_name = os.environ["DB1_NAME"]
+# The same indexes as the DDL above, for tables that existed before they were added to it. See ensure_indexes()
+_PURCHASES_INDEXES = {
+    "idx_purchases_owner_id": "CREATE INDEX idx_purchases_owner_id ON Purchases (owner_id)",
+    "idx_purchases_buyer_id": "CREATE INDEX idx_purchases_buyer_id ON Purchases (buyer_id)",
+}
+
+# Inserts the offer only if no rental is blocking the item. Doing the check inside the INSERT makes it one round trip
+# and closes the gap where a rental could be added between a separate check and the insert
+_SQL_INSERT_PURCHASE = """
+    INSERT INTO Purchases (
+        owner_id, buyer_id, item_id, status, purchase_price
+    )
+    SELECT %s, %s, %s, %s, %s
+    FROM DUAL
+    WHERE NOT EXISTS (
+        SELECT 1 FROM Rentals
+        WHERE item_id = %s AND status IN ('offered', 'confirmed', 'ongoing')
+    )
+"""
 
-    try:
-        transactions_conn = pymysql.connect(
-            host=transactions_db_rds_proxy_host,
-            user=transactions_db_user_name,
-            passwd=transactions_db_password,
-            db=transactions_db_name,
-            connect_timeout=5)
-        log.info("SUCCESS: Connection to Transactions DB succeeded")
-    except pymysql.MySQLError as e:
-        log.error("ERROR: Unexpected error: Could not connect to MySQL instance.")
-        log.error(e)
-        sys.exit(1)
-    return transactions_conn
+# Reads the new row back by primary key, so the response carries what MySQL stored: the generated created_at/updated_at
+# and the price rounded to DECIMAL(10, 2), rather than the raw request values
+_SQL_SELECT_PURCHASE = """
+    SELECT purchase_id, owner_id, buyer_id, item_id, status, purchase_price, purchase_date, created_at, updated_at
+    FROM Purchases WHERE purchase_id = %s
+"""
 
 
 def send_message(content):
+    # Only successful offers notify anyone, so requests turned away earlier never pay for importing websocket-client
+    from websocket import create_connection
+
     try:
         token = content.get("token")
         ws = create_connection(f"wss://6z72j61l2b.execute-api.ap-southeast-1.amazonaws.com/dev/?token={token}")
@@ -97,11 +97,11 @@ def send_message(content):
             "timestamp": datetime.now().isoformat(),
             "admin": "offered"
         }
-        log.info(json.dumps(message))
-        ws.send(json.dumps(message))
+        payload = json.dumps(message, separators=(",", ":"))  # Serialise once for both the log line and the send
+        log.info(payload)
+        ws.send(payload)
         log.info("Message sent")
-        result = ws.recv()
-        log.info("Received '%s'" % result)
+        # Don't wait for the echo: the caller's response doesn't depend on it, and the frame is already on its way
         ws.close()
         log.info("Message successfully sent!")
 
@@ -117,132 +117,60 @@ def send_message(content):
         }
 
 
-def response_headers(content_type: str):
-    headers = {
-        'Access-Control-Allow-Origin': '*',
-        'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-        'Access-Control-Allow-Headers': 'Content-Type',
-        'Content-Type': content_type
-    }
-    return headers
-
-
-def get_item(item_id):
-    """Gets item details from the item DB via API"""
-
-    api_url = f"https://pxgwc7gdz1.execute-api.ap-southeast-1.amazonaws.com/dev/items/{item_id}"
-
-    try:
-        response = requests.get(api_url)
-
-        if response.status_code == 200:
-            return response.json()
-        else:
-            return {
-                "status_code": response.status_code,
-                "body": response.text
-            }
-
-    except requests.exceptions.RequestException as e:
-        return {
-            "status_code": 500,
-            "headers": response_headers('text/plain'),
-            "body": f"Error occurred while making API call: {str(e)}"
-        }
-
-
-def check_item_rental_status(transactions_conn, item_id):
-    log.info(f"Checking for active rentals for item {item_id}")
-    try:
-        with transactions_conn.cursor() as cursor:
-            sql_query = """
-                SELECT * FROM Rentals
-                WHERE item_id = %s AND status NOT IN ("cancelled", "completed")
-            """
-            cursor.execute(sql_query, (item_id,))
-            results = cursor.fetchall()
-            log.info(f"Active rentals: {results}")
-
-            if results:
-                return {
-                    "status_code": 403,
-                    "headers": response_headers('text/plain'),
-                    "body": f"Active rentals found for item_id {item_id}: {results}"
-                }
-            else:
-                return {
-                    "status_code": 200,
-                    "headers": response_headers('text/plain'),
-                    "body": f"No active rentals found for item_id {item_id}"
-                }
-    except pymysql.MySQLError as e:
-        return {
-            "status_code": 500,
-            "headers": response_headers('text/plain'),
-            "body": f"An error occurred while querying the database: {str(e)}"
-        }
-
-
 def create_purchases_table(transactions_conn):
-    create_table_sql = """
-        CREATE TABLE IF NOT EXISTS Purchases (
-            purchase_id INT AUTO_INCREMENT PRIMARY KEY,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-            owner_id VARCHAR(255) NOT NULL,
-            buyer_id VARCHAR(255) NOT NULL,
-            item_id INT NOT NULL,
-            purchase_date DATE NULL,
-            status VARCHAR(255) NOT NULL,
-            purchase_price DECIMAL(10, 2) NOT NULL
-    )
-    """
-    # Create the table if it doesn't exist
+    # Create the table if it doesn't exist, and add any index an older copy of it is missing
     with transactions_conn.cursor() as cur:
-        cur.execute(create_table_sql)
-        transactions_conn.commit()
+        cur.execute(_SQL_CREATE_PURCHASES_TABLE)
+        ensure_indexes(cur, "Purchases", _PURCHASES_INDEXES)
 
 
-def create_purchase_entry(transactions_conn, event, item_id):
-    body = json.loads(event['body'])
-    users = body["users"]
+def create_purchase_entry(transactions_conn, body, item_id):
+    users = body.get("users") or {}
+    purchase_details = body.get("purchase_details") or {}
 
-    sql_string = """
-        insert into Purchases (
-            owner_id, buyer_id, item_id, status, purchase_price
+    try:
+        values = (
+            users["owner_id"],
+            users["buyer_id"],
+            item_id,
+            "offered",
+            float(purchase_details["purchase_price"]),
         )
-        values(%s, %s, %s, %s, %s)
-    """
-
-    values = (
-        users["owner_id"],
-        users["buyer_id"],
-        item_id,
-        "offered",
-        float(body["purchase_details"]["purchase_price"]),
-    )
+    except (KeyError, TypeError, ValueError) as e:
+        log.error("Invalid purchase request body: %r", e)
+        return {
+            "statusCode": 400,
+            "headers": TEXT_HEADERS,
+            "body": f"Missing or invalid field in request body: {e}"
+        }
 
-    log.info(f"Will insert:\n{values}")
+    log.debug("Will insert:\n%s", values)
 
     try:
         with transactions_conn.cursor(pymysql.cursors.DictCursor) as cur:
-            # Insert the entry
-            cur.execute(sql_string, values)
-            transactions_conn.commit()
+            # Insert the entry, unless the item has a blocking rental. A single statement, so autocommit keeps it atomic
+            cur.execute(_SQL_INSERT_PURCHASE, values + (item_id,))
 
-            # Get the purchase_id of the newly inserted entry
-            cur.execute("SELECT LAST_INSERT_ID() as purchase_id")
-            purchase_id = cur.fetchone()["purchase_id"]
-            log.info(f"New purchase_id is {purchase_id}")
+            if cur.rowcount == 0:
+                log.info("Active rentals found for item_id %s. No purchase created.", item_id)
+                return {
+                    "statusCode": 403,
+                    "headers": JSON_HEADERS,
+                    "body": json.dumps({
+                        "message": f"Active rentals found for item_id {item_id}"
+                    }, separators=(",", ":"))
+                }
 
-            # Get details of the newly inserted entry
-            cur.execute("SELECT * FROM Purchases WHERE purchase_id = %s", (purchase_id,))
-            purchase = cur.fetchone()
+            # Get the purchase_id of the newly inserted entry from the INSERT's own OK packet
+            purchase_id = cur.lastrowid
+            log.info("New purchase_id is %s", purchase_id)
             log.info("Purchase entry successfully inserted")
 
+            cur.execute(_SQL_SELECT_PURCHASE, (purchase_id,))
+            purchase = cur.fetchone()
             response = {
                 "statusCode": 200,
-                "headers": response_headers('application/json'),
+                "headers": JSON_HEADERS,
                 "body": json.dumps({
                     "purchase_id": purchase["purchase_id"],
                     "owner_id": purchase["owner_id"],
@@ -251,90 +179,114 @@ def create_purchase_entry(transactions_conn, event, item_id):
                     "status": purchase["status"],
                     "purchase_price": float(purchase["purchase_price"]),
                     "purchase_date": purchase["purchase_date"].isoformat() if purchase["purchase_date"] else None,
-                    "created_at": purchase["created_at"].isoformat() if isinstance(purchase["created_at"], (datetime, date)) else purchase["created_at"],
-                    "updated_at": purchase["updated_at"].isoformat() if isinstance(purchase["updated_at"], (datetime, date)) else purchase["updated_at"]
-                })
+                    "created_at": purchase["created_at"].isoformat(),
+                    "updated_at": purchase["updated_at"].isoformat()
+                }, separators=(",", ":"))
             }
-            log.info(f"Response: {response}")
+            log.debug("Response: %s", response)
             return response
     except pymysql.MySQLError as e:
         return {
             "statusCode": 500,
-            "headers": response_headers('text/plain'),
+            "headers": TEXT_HEADERS,
             "body": f"An error occurred while querying the database: {str(e)}"
         }
 
 
 def add_purchase(event, context):
-    log.info(event)
+    global _schema_ready
+    log.debug(event)
     item_id = event.get('pathParameters', {}).get('item_id')
     token = event["headers"]["Authorization"]
     clean_token = token.replace("Bearer ", "").strip()
 
-    auth = invoke_auth_lambda(clean_token)
+    # Verify the token in-process rather than paying for a synchronous invoke of the irentstuff-authenticate-user Lambda
+    try:
+        auth = verify_token(clean_token)
+    except Exception as e:
+        log.error("Token verification failed: %s", e)
+        auth = {"message": f"Invalid token: {e}", "username": None}
     auth_result = auth['message']
     requestor = auth['username']
 
-    item_details = get_item(item_id)  # Use the get_item() method to make an API call to the items DB to retrieve item info.
-    item_availability = item_details['availability']
-    item_owner = item_details['owner']
-    log.info(f"Purchase requestor: {requestor}, Item owner: {item_owner}. Renting from self: {requestor==item_owner}")
-
+    # Reject bad tokens before spending an items API call on them
     if auth_result != "Token is valid":
         log.error("User token is invalid")
         return {"statusCode": 401,
-                "headers": response_headers('text/plain'),
+                "headers": TEXT_HEADERS,
                 "body": "Your user token is invalid."}
-    elif requestor == item_owner:
+
+    # Parse the body once, up front, so a malformed request is turned away before the items API call
+    try:
+        body = json.loads(event.get("body") or "{}")
+    except ValueError:
+        body = None
+    if not isinstance(body, dict):
+        log.error("Request body is not a JSON object")
+        return {"statusCode": 400,
+                "headers": TEXT_HEADERS,
+                "body": "Request body must be a JSON object."}
+
+    # The items API call is the only I/O ahead of the INSERT, and the INSERT needs its answer first. The rental check
+    # runs inside the INSERT itself, so there is no independent DB query left to overlap this call with
+    item_details = get_item(item_id)  # Use the get_item() method to make an API call to the items DB to retrieve item info.
+    # get_item() returns {"status_code", "body"} instead of the item when the items API call fails
+    if "status_code" in item_details:
+        log.error("Could not get item %s from the items API: %s %s", item_id, item_details["status_code"], item_details["body"])
+        if item_details["status_code"] == 404:
+            return {"statusCode": 404,
+                    "headers": TEXT_HEADERS,
+                    "body": f"Item {item_id} not found."}
+        return {"statusCode": 502,
+                "headers": TEXT_HEADERS,
+                "body": "Could not retrieve the item details. Please try again."}
+    item_availability = item_details['availability']
+    item_owner = item_details['owner']
+    log.info("Purchase requestor: %s, Item owner: %s. Renting from self: %s", requestor, item_owner, requestor == item_owner)
+
+    if requestor == item_owner:
         log.error("Owner cannot purchase their own item")
         return {"statusCode": 400,
-                "headers": response_headers('text/plain'),
+                "headers": TEXT_HEADERS,
                 "body": "You cannot purchase your own item."}
     else:
         if item_availability == "active_rental":
             return {"statusCode": 400,
-                    "headers": response_headers('text/plain'),
+                    "headers": TEXT_HEADERS,
                     "body": "There are active rentals for this item. You cannot buy it until the rental has completed."}
         elif item_availability == "pending_purchase":
             return {"statusCode": 400,
-                    "headers": response_headers('text/plain'),
+                    "headers": TEXT_HEADERS,
                     "body": "There are pending purchases for this item. You cannot buy it."}
         elif item_availability == "sold":
             return {"statusCode": 400,
-                    "headers": response_headers('text/plain'),
+                    "headers": TEXT_HEADERS,
                     "body": "Item has been sold. You cannot sell it again. To sell another copy of this item, please create a new entry using the 'Add Stuff' button."}
         elif item_availability == "available":
-            log.info(f"Item ID [{item_id}], is {item_availability}. Confirming in Transactions DB.")
+            log.info("Item ID [%s], is %s. Confirming in Transactions DB.", item_id, item_availability)
 
             try:
-                transactions_conn = connect_to_db()
-                create_purchases_table(transactions_conn)  # if it doesn't exist
-
-                rentals = check_item_rental_status(transactions_conn, item_id)
-                log.info(rentals)
-
-                content = {
-                    "token": clean_token,
-                    "itemId": item_id,
-                    "ownerid": item_owner,
-                    "renterId": requestor,
-                    "username": requestor
-                }
-
-                message_response = send_message(content)
-                log.info(message_response)
-
-                if rentals["status_code"] != 200:
-                    return {
-                        "statusCode": rentals["status_code"],
-                        "headers": response_headers('application/json'),
-                        "body": json.dumps({
-                            "message": rentals["body"]
-                        })
+                transactions_conn = get_conn()
+                if not _schema_ready:
+                    create_purchases_table(transactions_conn)  # if it doesn't exist
+                    _schema_ready = True
+
+                entry = create_purchase_entry(transactions_conn, body, item_id)
+                if entry.get("statusCode") == 200:
+                    # The new offer changes the item's state, so don't serve the pre-offer snapshot to the next request
+                    invalidate_item(item_id)
+
+                    content = {
+                        "token": clean_token,
+                        "itemId": item_id,
+                        "ownerid": item_owner,
+                        "renterId": requestor,
+                        "username": requestor
                     }
-                else:
-                    log.info(f"No existing active rentals found for item_id {item_id}. Proceeding to create new purchase entry.")
-                    return create_purchase_entry(transactions_conn, event, item_id)
+
+                    message_response = send_message(content)
+                    log.info(message_response)
+                return entry
             except Exception as e:
                 log.error(e)
                 return {
@@ -342,5 +294,14 @@ def add_purchase(event, context):
                     "headers": {"Content-Type": "text/plain"},
                     "body": f"An error occurred while adding the rental: {e}"
                 }
-            finally:
-                transactions_conn.close()
+
+
+# Provisioned containers run their init ahead of traffic, so open the DB connection and make sure the table exists then
+# instead of on the first request. A failure here is not fatal: the handler connects and creates the table lazily.
+# connect_to_db() calls sys.exit() when it can't connect, so SystemExit is caught too or a DB blip would kill the sandbox
+if os.getenv("AWS_LAMBDA_INITIALIZATION_TYPE") == "provisioned-concurrency":
+    try:
+        create_purchases_table(get_conn())
+        _schema_ready = True
+    except (Exception, SystemExit) as e:
+        log.warning("Could not warm up the Transactions DB connection during init: %r", e)
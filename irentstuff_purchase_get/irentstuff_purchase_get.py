@@ -1,73 +1,38 @@
 """Retrieve a Purchase from the Purchases db"""
 
-from decimal import Decimal
-
 import json
 import logging
-import pymysql
 import os
-import sys
 
-from pymysql.cursors import DictCursor
-from datetime import datetime, date
+from irentstuff_common.encoding import ROW_ENCODER
 
 log = logging.getLogger()
-log.setLevel(logging.INFO)
-
+# WARNING by default: CloudWatch bills per GB ingested and formatting log lines costs CPU on every request.
+# Set LOG_LEVEL=INFO or DEBUG on the function to get the detailed logs back while debugging
+log.setLevel(os.environ.get("LOG_LEVEL", "WARNING"))
 
-def connect_to_db():
-    "Connect to Transactions DB"
-    transactions_conn = None
-    transactions_db_user_name = os.environ["DB1_USER_NAME"]
-    transactions_db_password = os.environ["DB1_PASSWORD"]
-    transactions_db_rds_proxy_host = os.environ["DB1_RDS_PROXY_HOST"]
-    transactions_db_name = os.environ["DB1_NAME"]
-
-    try:
-        transactions_conn = pymysql.connect(
-            host=transactions_db_rds_proxy_host,
-            user=transactions_db_user_name,
-            passwd=transactions_db_password,
-            db=transactions_db_name,
-            connect_timeout=5,
-            cursorclass=DictCursor
-        )
-        log.info("SUCCESS: Connection to Transactions DB succeeded")
-    except pymysql.MySQLError as e:
-        log.error("ERROR: Unexpected error: Could not connect to MySQL instance.")
-        log.error(e)
-        sys.exit(1)
-    return transactions_conn
+_PURCHASE_COLUMNS = ("purchase_id", "created_at", "owner_id", "buyer_id", "item_id", "purchase_date", "status", "purchase_price")
+# purchase_id is the primary key, so MySQL resolves this as a single-row const lookup and only checks item_id against
+# that row. Keeping item_id in the WHERE clause costs nothing and stops a purchase being read through another item's URL
+_SQL_SELECT_PURCHASE = f"SELECT {', '.join(_PURCHASE_COLUMNS)} FROM Purchases WHERE item_id = %s AND purchase_id = %s"
 
 
 def retrieve_updated_purchase(cursor, item_id, purchase_id):
-    retrieve_query = "SELECT * FROM Purchases WHERE item_id = %s AND purchase_id = %s"
-    cursor.execute(retrieve_query, (item_id, purchase_id))
+    cursor.execute(_SQL_SELECT_PURCHASE, (item_id, purchase_id))
     purchase = cursor.fetchone()
-    log.info(purchase)
+    log.debug(purchase)
 
     if purchase:
-        response = {
-            "purchase_id": purchase["purchase_id"],
-            "created_at": purchase["created_at"].isoformat() if isinstance(purchase["created_at"], (datetime, date)) else purchase["created_at"],
-            "owner_id": purchase["owner_id"],
-            "buyer_id": purchase["buyer_id"],
-            "item_id": purchase["item_id"],
-            "purchase_date": purchase["purchase_date"].isoformat() if isinstance(purchase["purchase_date"], date) else purchase["purchase_date"],
-            "status": purchase["status"],
-            "purchase_price": float(purchase["purchase_price"]) if isinstance(purchase["purchase_price"], Decimal) else purchase["purchase_price"],
-            }
-        return response
+        # Values are left as pymysql returned them; ROW_ENCODER formats dates and prices when the body is encoded
+        return purchase
     else:
         return {"error": "Purchase not found"}
 
 
 def get_purchase(event, context):
-    transactions_conn = connect_to_db()
-
     item_id = event.get('pathParameters', {}).get('item_id')
     purchase_id = event.get('pathParameters', {}).get('purchase_id')
-    log.info(f"item_id: {item_id}, purchase_id: {purchase_id}")
+    log.info("item_id: %s, purchase_id: %s", item_id, purchase_id)
 
     if not item_id or not purchase_id:
         return {
@@ -78,7 +43,13 @@ def get_purchase(event, context):
             "body": json.dumps({"error": "Missing item_id or purchase_id"})
         }
 
+    # pymysql (and the layer's db module, which imports it) is imported only once a request gets this far, so a cold
+    # start that ends in the 400 above skips loading it. After the first import this is just a sys.modules lookup
+    import pymysql
+    from irentstuff_common import db
+
     try:
+        transactions_conn = db.get_conn()
         with transactions_conn.cursor(pymysql.cursors.DictCursor) as cursor:
             response = retrieve_updated_purchase(cursor, item_id, purchase_id)
 
@@ -87,7 +58,7 @@ def get_purchase(event, context):
                 "headers": {
                     "Content-Type": "application/json"
                 },
-                "body": json.dumps(response)
+                "body": ROW_ENCODER.encode(response)
             }
 
     except pymysql.MySQLError as e:
@@ -101,6 +72,3 @@ def get_purchase(event, context):
             },
             "body": f"An error occurred while retrieving the purchase status: {str(e)}"
         }
-    finally:
-        if transactions_conn:
-            transactions_conn.close()
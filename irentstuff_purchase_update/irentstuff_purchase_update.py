@@ -1,79 +1,43 @@
 """Confirm a Purchase in the Purchases db. Triggered by Owner"""
 
-from datetime import (datetime, date)
-from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 
-import boto3
-import sys
 import logging
 import pymysql
 import json
 import os
 import requests
 
-from websocket import create_connection
+from irentstuff_common.auth import verify_token
+from irentstuff_common.db import get_conn
+from irentstuff_common.encoding import ROW_ENCODER
+from irentstuff_common.headers import JSON_HEADERS, TEXT_HEADERS
+from irentstuff_common.session import SESSION
 
 log = logging.getLogger()
-log.setLevel(logging.INFO)
+# WARNING by default: CloudWatch bills per GB ingested and formatting log lines costs CPU on every request.
+# Set LOG_LEVEL=INFO or DEBUG on the function to get the detailed logs back while debugging
+log.setLevel(os.environ.get("LOG_LEVEL", "WARNING"))
 
-lambda_client = boto3.client('lambda', region_name="ap-southeast-1")
+# The PATCH to the Items API goes through the layer's pooled SESSION, the same keep-alive pool get_item() uses
+_ITEMS_API_URL = "https://pxgwc7gdz1.execute-api.ap-southeast-1.amazonaws.com/dev/items/"
 
-
-def invoke_auth_lambda(jwt_token):
-    # Prepare the payload to send to the authentication Lambda
-    payload = {
-        "headers": {
-            "Authorization": jwt_token
-        }
-    }
-
-    # Invoke the authentication Lambda function
-    response = lambda_client.invoke(
-        FunctionName='irentstuff-authenticate-user',  # Replace with the actual Lambda function name
-        InvocationType='RequestResponse',  # Synchronous invocation
-        Payload=json.dumps(payload)
-    )
-
-    # Read the response from the invoked function
-    response_payload = json.loads(response['Payload'].read())
-    log.info(response_payload)
-
-    # Process the response based on the status code
-    if response['StatusCode'] == 200:
-        # The authentication Lambda responded successfully
-        return json.loads(response_payload.get('body'))
-    else:
-        # Handle the case where the authentication failed
-        raise Exception(f"Authentication failed: {response_payload.get('body')}")
-
-
-def connect_to_db():
-    "Connect to Transactions DB"
-    transactions_conn = None
-    transactions_db_user_name = os.environ["DB1_USER_NAME"]
-    transactions_db_password = os.environ["DB1_PASSWORD"]
-    transactions_db_rds_proxy_host = os.environ["DB1_RDS_PROXY_HOST"]
-    transactions_db_name = os.environ["DB1_NAME"]
-
-    try:
-        transactions_conn = pymysql.connect(
-            host=transactions_db_rds_proxy_host,
-            user=transactions_db_user_name,
-            passwd=transactions_db_password,
-            db=transactions_db_name,
-            connect_timeout=5)
-        log.info("SUCCESS: Connection to Transactions DB succeeded")
-    except pymysql.MySQLError as e:
-        log.error("ERROR: Unexpected error: Could not connect to MySQL instance.")
-        log.error(e)
-        sys.exit(1)
-    return transactions_conn
+# Runs the handler's independent work side by side: the Items API PATCH with the WebSocket notification. Reused across
+# warm invocations; the handler waits on every future before it returns, so nothing is left running when Lambda freezes
+# the container
+EXECUTOR = ThreadPoolExecutor(max_workers=2)
 
 
 def send_message(content):
+    # Only successful updates notify anyone, so requests turned away earlier never pay for importing websocket-client
+    from websocket import create_connection
+
     try:
         token = content.get("token")
-        ws = create_connection(f"wss://6z72j61l2b.execute-api.ap-southeast-1.amazonaws.com/dev/?token={token}")
+        # A fresh socket per message: it's opened with the requestor's token, so it can't be shared with the next caller.
+        # The timeout bounds the handshake and send, since the handler now waits on this before responding
+        ws = create_connection(f"wss://6z72j61l2b.execute-api.ap-southeast-1.amazonaws.com/dev/?token={token}", timeout=2)
         log.info("WebSocket connection opened")
 
         message = {
@@ -86,11 +50,9 @@ def send_message(content):
             "timestamp": datetime.now().isoformat(),
             "admin": content.get("admin")
         }
-        log.info(json.dumps(message))
-        ws.send(json.dumps(message))
+        ws.send(json.dumps(message, separators=(",", ":")))
         log.info("Message sent")
-        result = ws.recv()
-        log.info("Received '%s'" % result)
+        # Don't wait for the echo: the caller's response doesn't depend on it, and the frame is already on its way
         ws.close()
         log.info("Message successfully sent!")
 
@@ -106,61 +68,72 @@ def send_message(content):
         }
 
 
-def response_headers(content_type: str):
-    headers = {
-        "Access-Control-Allow-Origin": "*",
-        "Access-Control-Allow-Methods": "GET, PATCH, OPTIONS",
-        "Access-Control-Allow-Headers": "Content-Type",
-        "Content-Type": content_type
-    }
-    return headers
+# The columns of the response, named so a column added to Purchases later isn't shipped to the caller unnoticed
+_PURCHASE_COLUMNS = (
+    "purchase_id", "created_at", "updated_at", "owner_id", "buyer_id", "item_id", "purchase_date", "status", "purchase_price"
+)
+_SQL_SELECT_PURCHASE = f"SELECT {', '.join(_PURCHASE_COLUMNS)} FROM Purchases WHERE item_id = %s AND purchase_id = %s"
+# Only the status is needed to explain why an UPDATE matched nothing
+_SQL_SELECT_STATUS = "SELECT status FROM Purchases WHERE purchase_id = %s AND item_id = %s"
 
 
 def retrieve_updated_purchase(cursor, item_id, purchase_id):
-    retrieve_query = "SELECT * FROM Purchases WHERE item_id = %s AND purchase_id = %s"
-    cursor.execute(retrieve_query, (item_id, purchase_id))
+    "Return the purchase row as pymysql gives it; ROW_ENCODER formats its dates and prices when the response is built"
+    cursor.execute(_SQL_SELECT_PURCHASE, (item_id, purchase_id))
     purchase = cursor.fetchone()
-    log.info(purchase)
+    log.debug(purchase)
 
     if purchase:
-        response = {
-            "purchase_id": purchase["purchase_id"],
-            "owner_id": purchase["owner_id"],
-            "buyer_id": purchase["buyer_id"],
-            "item_id": purchase["item_id"],
-            "status": purchase["status"],
-            "purchase_price": float(purchase["purchase_price"]) if isinstance(purchase["purchase_price"], Decimal) else purchase["purchase_price"],
-            "purchase_date": purchase["purchase_date"].isoformat() if isinstance(purchase["purchase_date"], date) else purchase["purchase_date"],
-            "created_at": purchase["created_at"].isoformat() if isinstance(purchase["created_at"], (datetime, date)) else purchase["created_at"],
-            "updated_at": purchase["updated_at"].isoformat() if isinstance(purchase["updated_at"], (datetime, date)) else purchase["updated_at"]
-            }
-        return response
+        return purchase
     else:
         return {"error": "Purchase not found"}
 
 
-def update_db(cursor, new_status, purchase_id, item_id, transactions_conn):
-    # Update the purchase status in the DB. If item is sold, automatically logs purchase date as today
-    if new_status == "sold":
-        update_query = "UPDATE Purchases SET status = %s, purchase_date = NOW() WHERE purchase_id = %s AND item_id = %s"
-    else:
-        update_query = "UPDATE Purchases SET status = %s WHERE purchase_id = %s AND item_id = %s"
-    cursor.execute(update_query, (new_status, purchase_id, item_id))
-    transactions_conn.commit()
+# Accepted actions, with the statuses each may move a purchase from and who may request it. Both conditions live in the
+# UPDATE's WHERE clause, so a valid request costs the UPDATE plus one SELECT of the result instead of a SELECT before it too.
+# The UPDATE's parameters are always (purchase_id, item_id, requestor)
+_ACTIONS = {
+    "confirm": {
+        "from": ("offered",),
+        "to": "confirmed",
+        "availability": "pending_purchase",
+        "sql": "UPDATE Purchases SET status = 'confirmed' WHERE purchase_id = %s AND item_id = %s AND status = 'offered' AND owner_id = %s",
+        "forbidden": "Only the item owner can confirm the purchase request."
+    },
+    "cancel": {
+        "from": ("offered", "confirmed"),
+        "to": "cancelled",
+        "availability": "available",
+        "sql": "UPDATE Purchases SET status = 'cancelled' WHERE purchase_id = %s AND item_id = %s "
+               "AND status IN ('offered', 'confirmed') AND %s IN (owner_id, buyer_id)",
+        "forbidden": "Only the item owner or buyer can cancel the purchase request."
+    },
+    "complete": {
+        # If item is sold, automatically logs purchase date as today
+        "from": ("confirmed",),
+        "to": "sold",
+        "availability": "sold",
+        "sql": "UPDATE Purchases SET status = 'sold', purchase_date = NOW() WHERE purchase_id = %s AND item_id = %s "
+               "AND status = 'confirmed' AND owner_id = %s",
+        "forbidden": "Only the item owner can complete the purchase request."
+    }
+}
 
-    response = retrieve_updated_purchase(cursor, item_id, purchase_id)
 
-    return {
-        "statusCode": 200,
-        "headers": response_headers('application/json'),
-        "body": json.dumps(response)
-    }
+def update_db(cursor, action, requestor, purchase_id, item_id):
+    "Apply action to the purchase if its status and requestor allow it. Returns the updated purchase, or None if nothing matched"
+    # The connection autocommits, so the UPDATE is committed without a separate COMMIT round trip
+    cursor.execute(_ACTIONS[action]["sql"], (purchase_id, item_id, requestor))
+
+    if cursor.rowcount == 0:
+        return None
+    return retrieve_updated_purchase(cursor, item_id, purchase_id)
 
 
 def update_availability_in_items_db(token, item_id, availability):
     """Updates item availability in the item DB via API using a PATCH request"""
 
-    api_url = f"https://pxgwc7gdz1.execute-api.ap-southeast-1.amazonaws.com/dev/items/{item_id}"
+    api_url = f"{_ITEMS_API_URL}{item_id}"
 
     headers = {
         "Authorization": f"Bearer {token}",
@@ -174,10 +147,10 @@ def update_availability_in_items_db(token, item_id, availability):
 
     try:
         # Make the PATCH request
-        response = requests.patch(api_url, headers=headers, json=payload)
+        response = SESSION.patch(api_url, headers=headers, json=payload, timeout=(3, 5))
 
         if response.status_code == 200:
-            log.info(f"Availability for item {item_id} successfully updated to {availability}")
+            log.info("Availability for item %s successfully updated to %s", item_id, availability)
             return response.json()
         else:
             return {
@@ -193,132 +166,90 @@ def update_availability_in_items_db(token, item_id, availability):
 
 
 def update_purchase_status(event, context):
-    transactions_conn = connect_to_db()
-    log.info(event)
+    log.debug(event)
 
-    item_id = event.get('pathParameters', {}).get('item_id')
-    purchase_id = event.get('pathParameters', {}).get('purchase_id')
-    action = event.get("pathParameters", {}).get("action")  # Accepted actions: "confirm", "cancel", "complete"
-    log.info(f"item_id: {item_id}, purchase_id: {purchase_id}, action: {action}")
+    path_params = event.get("pathParameters", {})
+    item_id = path_params.get("item_id")
+    purchase_id = path_params.get("purchase_id")
+    action = path_params.get("action")  # Accepted actions: "confirm", "cancel", "complete"
+    # %-style arguments so the message is only formatted when INFO is enabled, which it isn't by default
+    log.info("item_id: %s, purchase_id: %s, action: %s", item_id, purchase_id, action)
 
     token = event["headers"]["Authorization"]
-    clean_token = token.replace("Bearer ", "").strip()
-
-    auth = invoke_auth_lambda(clean_token)
-    log.info(f"{auth=}")
-    auth_result = auth['message']
-    requestor = auth['username']
-    log.info(f"{auth_result=}")
-    log.info(f"{requestor=}")
+    clean_token = token.removeprefix("Bearer ").strip()
 
-    if auth_result != "Token is valid":
-        log.error("User token is invalid")
+    # Verify the token in-process rather than paying for a synchronous invoke of the irentstuff-authenticate-user Lambda.
+    # Done before touching the DB so a bad or missing token is turned away without opening or pinging a connection
+    try:
+        auth = verify_token(clean_token)
+    except Exception as e:
+        log.error("Token verification failed: %s", e)
         return {"statusCode": 401,
-                "headers": response_headers('text/plain'),
+                "headers": TEXT_HEADERS,
                 "body": "Your user token is invalid."}
-    else:
-        try:
-            with transactions_conn.cursor(pymysql.cursors.DictCursor) as cursor:
-                # Retrieve the purchase by purchase_id and item_id
-                log.info(f"purchase_id: {purchase_id}, item_id: {item_id}")
-                select_query = "SELECT * FROM Purchases WHERE purchase_id = %s AND item_id = %s"
-                cursor.execute(select_query, (purchase_id, item_id))
-                purchase = cursor.fetchone()
-
-                if purchase:
-                    log.info(f"{purchase=}")
-                    item_owner = purchase["owner_id"]
-                    item_buyer = purchase["buyer_id"]
-                    current_status = purchase["status"]
-
-                    content = {
-                        "token": clean_token,
-                        "itemId": item_id,
-                        "ownerid": item_owner,
-                        "renterId": item_buyer
-                    }
-
-                    # Confirm purchase
-                    if action == "confirm" and current_status == "offered":
-                        if requestor == item_owner:
-                            new_status = "confirmed"
-                            log.info(f"Request passed all authentication checks. Item will be {new_status}")
-                            db_update = update_db(cursor, new_status, purchase_id, item_id, transactions_conn)
-
-                            # Update availability in items DB
-                            update_availability_in_items_db(clean_token, item_id, availability="pending_purchase")
-
-                            # Send message
-                            content["username"] = item_owner
-                            content["admin"] = "confirmed"
-                            message_response = send_message(content)
-                            log.info(message_response)
-                        else:
-                            log.error("Requestor is not item owner")
-                            db_update = {"statusCode": 401,
-                                         "headers": response_headers('text/plain'),
-                                         "body": "Only the item owner can confirm the purchase request."}
-
-                    # Cancel purchase
-                    elif action == "cancel" and current_status in ("offered", "confirmed"):
-                        if requestor in (item_owner, item_buyer):
-                            new_status = "cancelled"
-                            log.info(f"Request passed all authentication checks. Item will be {new_status}")
-                            db_update = update_db(cursor, new_status, purchase_id, item_id, transactions_conn)
-
-                            # Update availability in items DB
-                            update_availability_in_items_db(clean_token, item_id, availability="available")
-
-                            # Send message
-                            content["username"] = requestor
-                            content["admin"] = "cancelled"
-                            message_response = send_message(content)
-                            log.info(message_response)
-                        else:
-                            log.error("Requestor is not item owner or buyer")
-                            db_update = {"statusCode": 401,
-                                         "headers": response_headers('text/plain'),
-                                         "body": "Only the item owner or buyer can cancel the purchase request."}
-
-                    # Complete purchase
-                    elif action == "complete" and current_status == "confirmed":
-                        if requestor == item_owner:
-                            new_status = "sold"
-                            log.info(f"Request passed all authentication checks. Item will be {new_status}")
-                            db_update = update_db(cursor, new_status, purchase_id, item_id, transactions_conn)
-
-                            # Update availability in items DB
-                            update_availability_in_items_db(clean_token, item_id, availability="sold")
-
-                            # Send message
-                            content["username"] = item_owner
-                            content["admin"] = "sold"
-                            message_response = send_message(content)
-                            log.info(message_response)
-                        else:
-                            log.error("Requestor is not item owner")
-                            db_update = {"statusCode": 401,
-                                         "headers": response_headers('text/plain'),
-                                         "body": "Only the item owner can complete the purchase request."}
-                    else:
-                        db_update = {
-                            "statusCode": 400,
-                            "headers": response_headers('text/plain'),
-                            "body": f"Cannot perform '{action}' update on Item ID '{item_id}' with Purchase ID '{purchase_id}' because the current status is '{current_status}'."
-                        }
-
-                    return db_update
-                else:
-                    return {
-                        "statusCode": 404,
-                        "headers": response_headers('text/plain'),
-                        "body": f"Purchase ID {purchase_id} with Item ID {item_id} not found."
-                    }
-        except pymysql.MySQLError as e:
+    log.debug("auth=%s", auth)
+    requestor = auth['username']
+
+    transactions_conn = get_conn()
+
+    try:
+        with transactions_conn.cursor(pymysql.cursors.DictCursor) as cursor:
+            transition = _ACTIONS.get(action)
+            purchase = update_db(cursor, action, requestor, purchase_id, item_id) if transition else None
+
+            if purchase:
+                new_status = transition["to"]
+                log.info("Request passed all authentication checks. Item is now %s", new_status)
+
+                # Update availability in items DB and send message together
+                availability_future = EXECUTOR.submit(
+                    update_availability_in_items_db, clean_token, item_id, availability=transition["availability"])
+                # Every transition is requested by the owner except cancel, which the buyer may also request
+                message_future = EXECUTOR.submit(send_message, {
+                    "token": clean_token,
+                    "itemId": item_id,
+                    "ownerid": purchase.get("owner_id"),
+                    "renterId": purchase.get("buyer_id"),
+                    "username": requestor,
+                    "admin": new_status
+                })
+                # Both already turn their own failures into a result, so result() only waits
+                log.info(availability_future.result())
+                log.info(message_future.result())
+
+                return {
+                    "statusCode": 200,
+                    "headers": JSON_HEADERS,
+                    "body": ROW_ENCODER.encode(purchase)
+                }
+
+            # Nothing was updated, so look the purchase up to tell the caller why
+            cursor.execute(_SQL_SELECT_STATUS, (purchase_id, item_id))
+            purchase = cursor.fetchone()
+
+            if not purchase:
+                return {
+                    "statusCode": 404,
+                    "headers": TEXT_HEADERS,
+                    "body": f"Purchase ID {purchase_id} with Item ID {item_id} not found."
+                }
+
+            log.debug("purchase=%s", purchase)
+            current_status = purchase["status"]
+            if transition and current_status in transition["from"]:
+                log.error("Requestor is not allowed to %s this purchase", action)
+                return {"statusCode": 401,
+                        "headers": TEXT_HEADERS,
+                        "body": transition["forbidden"]}
+
             return {
-                "statusCode": 500,
-                "headers": response_headers('text/plain'),
-                "body": f"An error occurred while updating the rental status: {str(e)}"
+                "statusCode": 400,
+                "headers": TEXT_HEADERS,
+                "body": f"Cannot perform '{action}' update on Item ID '{item_id}' with Purchase ID '{purchase_id}' because the current status is '{current_status}'."
             }
-        finally:
-            transactions_conn.close()
+    except pymysql.MySQLError as e:
+        return {
+            "statusCode": 500,
+            "headers": TEXT_HEADERS,
+            "body": f"An error occurred while updating the rental status: {str(e)}"
+        }
@@ -1,6 +1,4 @@
 import json
-import os
-import pymysql
 import pytest
 import requests
 
@@ -10,10 +8,7 @@ from unittest import TestCase
 from unittest.mock import patch, MagicMock
 
 from irentstuff_purchase_update import (
-    invoke_auth_lambda,
-    connect_to_db,
     send_message,
-    response_headers,
     retrieve_updated_purchase,
     update_db,
     update_availability_in_items_db,
@@ -21,90 +16,14 @@ from irentstuff_purchase_update import (
 )
 
 
-class TestAuthLambda:
-    @patch("irentstuff_purchase_update.lambda_client.invoke")
-    def test_invoke_auth_lambda_success(self, mock_invoke):
-        # Mock successful Lambda invocation
-        mock_payload = {
-            'body': json.dumps({"user": "authenticated_user"})
-        }
-        mock_response = {
-            'StatusCode': 200,
-            'Payload': MagicMock(read=MagicMock(return_value=json.dumps(mock_payload)))
-        }
-
-        mock_invoke.return_value = mock_response
-        jwt_token = "test_jwt_token"
-
-        # Call the function
-        result = invoke_auth_lambda(jwt_token)
-
-        # Assertions
-        mock_invoke.assert_called_once_with(
-            FunctionName='irentstuff-authenticate-user',
-            InvocationType='RequestResponse',
-            Payload=json.dumps({
-                "headers": {
-                    "Authorization": jwt_token
-                }
-            })
-        )
-
-        assert result == {"user": "authenticated_user"}
-
-
-class TestConnectToDB(TestCase):
-    @classmethod
-    def setUpClass(cls):
-        # Set up environment variables for testing
-        os.environ["DB1_USER_NAME"] = "test_user"
-        os.environ["DB1_PASSWORD"] = "test_password"
-        os.environ["DB1_RDS_PROXY_HOST"] = "test_host"
-        os.environ["DB1_NAME"] = "test_db"
-
-    @patch("pymysql.connect")
-    def test_connect_to_db_success(self, mock_connect):
-        # Mock the connection object
-        mock_conn = MagicMock()
-        mock_connect.return_value = mock_conn
-
-        # Call the function
-        result = connect_to_db()
-
-        # Assert that the connect function was called with the expected arguments
-        mock_connect.assert_called_once_with(
-            host=os.environ["DB1_RDS_PROXY_HOST"],
-            user=os.environ["DB1_USER_NAME"],
-            passwd=os.environ["DB1_PASSWORD"],
-            db=os.environ["DB1_NAME"],
-            connect_timeout=5
-        )
-
-        # Assert that the returned connection is the mocked connection
-        self.assertEqual(result, mock_conn)
-
-    @patch("pymysql.connect")
-    @patch("sys.exit")  # Mock sys.exit to prevent the script from exiting
-    def test_connect_to_db_failure(self, mock_exit, mock_connect):
-        # Simulate a MySQL error when trying to connect
-        mock_connect.side_effect = pymysql.MySQLError("Connection error")
-
-        # Call the function (no need to expect SystemExit since we're mocking sys.exit)
-        connect_to_db()
-
-        # Assert that sys.exit was called with the correct exit code
-        mock_exit.assert_called_once_with(1)
-
-
 class TestSendMessage(TestCase):
 
-    @patch("irentstuff_purchase_update.create_connection")  # Mock the WebSocket connection
+    @patch("websocket.create_connection")  # Mock the WebSocket connection
     @patch("irentstuff_purchase_update.log")  # Mock logging
     def test_send_message_success(self, mock_log, mock_create_connection):
         # Arrange
         ws_mock = MagicMock()
         mock_create_connection.return_value = ws_mock
-        ws_mock.recv.return_value = "Success message"  # Mock receiving a WebSocket response
 
         content = {
             "token": "test_token",
@@ -118,16 +37,17 @@ class TestSendMessage(TestCase):
         response = send_message(content)
 
         # Assert
-        mock_create_connection.assert_called_once_with("wss://6z72j61l2b.execute-api.ap-southeast-1.amazonaws.com/dev/?token=test_token")
+        mock_create_connection.assert_called_once_with("wss://6z72j61l2b.execute-api.ap-southeast-1.amazonaws.com/dev/?token=test_token", timeout=2)
         self.assertEqual(response, {
             "statusCode": 200,
             "body": "WebSocket connection initiated"
         })
         ws_mock.send.assert_called_once()  # Ensure the message was sent
+        ws_mock.recv.assert_not_called()  # The echo is not waited for
         ws_mock.close.assert_called_once()  # Ensure the WebSocket connection was closed
         mock_log.info.assert_called()  # Check that logs were recorded
 
-    @patch("irentstuff_purchase_update.create_connection", side_effect=Exception("Connection failed"))  # Mock failure
+    @patch("websocket.create_connection", side_effect=Exception("Connection failed"))  # Mock failure
     @patch("irentstuff_purchase_update.log")
     def test_send_message_failure(self, mock_log, mock_create_connection):
         # Arrange
@@ -146,36 +66,6 @@ class TestSendMessage(TestCase):
         mock_log.error.assert_called_once_with("Message failed to send!")
 
 
-class TestResponseHeaders:
-    def test_response_headers(self):
-        # Test case for when content_type is 'application/json'
-        content_type = "application/json"
-        expected_headers = {
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'GET, PATCH, OPTIONS',
-            'Access-Control-Allow-Headers': 'Content-Type',
-            'Content-Type': content_type
-        }
-
-        result = response_headers(content_type)
-        assert result == expected_headers
-        assert result['Content-Type'] == 'application/json'
-
-    def test_response_headers_text(self):
-        # Test case for when content_type is 'text/html'
-        content_type = "text/html"
-        expected_headers = {
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'GET, PATCH, OPTIONS',
-            'Access-Control-Allow-Headers': 'Content-Type',
-            'Content-Type': content_type
-        }
-
-        result = response_headers(content_type)
-        assert result == expected_headers
-        assert result['Content-Type'] == 'text/html'
-
-
 class TestRetrieveUpdatedPurchase(TestCase):
     def test_retrieve_updated_purchase_found(self):
         # Mock the cursor and its fetchone() method
@@ -195,18 +85,15 @@ class TestRetrieveUpdatedPurchase(TestCase):
         # Call the function
         response = retrieve_updated_purchase(mock_cursor, "item_123", "purchase_123")
 
-        # Expected response
-        expected_response = {
-            "purchase_id": "purchase_123",
-            "created_at": "2023-10-01T14:30:00",
-            "updated_at": "2023-10-05T16:45:00",
-            "owner_id": "owner_001",
-            "buyer_id": "buyer_002",
-            "item_id": "item_123",
-            "status": "active",
-            "purchase_price": 15.00,
-            "purchase_date": "2023-11-05T16:45:00",
-        }
+        # Only the response's columns are selected
+        mock_cursor.execute.assert_called_once_with(
+            "SELECT purchase_id, created_at, updated_at, owner_id, buyer_id, item_id, purchase_date, status, purchase_price "
+            "FROM Purchases WHERE item_id = %s AND purchase_id = %s",
+            ("item_123", "purchase_123")
+        )
+
+        # The row is returned unformatted; the handler's encoder formats it
+        expected_response = mock_cursor.fetchone.return_value
 
         # Assert the response matches the expected response
         self.assertEqual(response, expected_response)
@@ -228,10 +115,10 @@ class TestRetrieveUpdatedPurchase(TestCase):
 
 class TestUpdateDB(TestCase):
     @patch("irentstuff_purchase_update.retrieve_updated_purchase")  # Mock the function call for retrieve_updated_purchase
-    def test_update_db_status_sold(self, mock_retrieve_updated_purchase):
+    def test_update_db_complete(self, mock_retrieve_updated_purchase):
         # Arrange
         mock_cursor = MagicMock()
-        mock_transactions_conn = MagicMock()
+        mock_cursor.rowcount = 1
 
         # Set up the mock response for retrieve_updated_purchase
         mock_retrieve_updated_purchase.return_value = {
@@ -241,80 +128,49 @@ class TestUpdateDB(TestCase):
             "purchase_date": "2024-10-09"
         }
 
-        # Inputs
-        new_status = "sold"
-        purchase_id = 1
-        item_id = 2
-
         # Act
-        response = update_db(mock_cursor, new_status, purchase_id, item_id, mock_transactions_conn)
+        purchase = update_db(mock_cursor, "complete", "owner1", 1, 2)
 
         # Assert
-        # Check if the correct query was executed for the "sold" status
+        # The status, requestor and purchase date are all handled by the one UPDATE
         mock_cursor.execute.assert_called_once_with(
-            "UPDATE Purchases SET status = %s, purchase_date = NOW() WHERE purchase_id = %s AND item_id = %s",
-            (new_status, purchase_id, item_id)
+            "UPDATE Purchases SET status = 'sold', purchase_date = NOW() WHERE purchase_id = %s AND item_id = %s "
+            "AND status = 'confirmed' AND owner_id = %s",
+            (1, 2, "owner1")
         )
 
-        # Ensure the transaction was committed
-        mock_transactions_conn.commit.assert_called_once()
-
         # Check if retrieve_updated_purchase was called with correct parameters
-        mock_retrieve_updated_purchase.assert_called_once_with(mock_cursor, item_id, purchase_id)
-
-        # Check the response format and content
-        self.assertEqual(response["statusCode"], 200)
-        self.assertEqual(response["headers"]["Content-Type"], "application/json")
-        self.assertIn("purchase_id", response["body"])
-        self.assertIn("status", response["body"])
-        self.assertIn("purchase_date", response["body"])
+        mock_retrieve_updated_purchase.assert_called_once_with(mock_cursor, 2, 1)
+        self.assertEqual(purchase, mock_retrieve_updated_purchase.return_value)
 
     @patch("irentstuff_purchase_update.retrieve_updated_purchase")
-    def test_update_db_status_not_sold(self, mock_retrieve_updated_purchase):
-        # Arrange
+    def test_update_db_cancel(self, mock_retrieve_updated_purchase):
         mock_cursor = MagicMock()
-        mock_transactions_conn = MagicMock()
-
-        # Set up the mock response for retrieve_updated_purchase
-        mock_retrieve_updated_purchase.return_value = {
-            "purchase_id": 1,
-            "item_id": 2,
-            "status": "pending",
-            "purchase_date": None
-        }
-
-        # Inputs
-        new_status = "pending"
-        purchase_id = 1
-        item_id = 2
+        mock_cursor.rowcount = 1
 
-        # Act
-        response = update_db(mock_cursor, new_status, purchase_id, item_id, mock_transactions_conn)
+        update_db(mock_cursor, "cancel", "buyer1", 1, 2)
 
-        # Assert
-        # Check if the correct query was executed for the "pending" status
         mock_cursor.execute.assert_called_once_with(
-            "UPDATE Purchases SET status = %s WHERE purchase_id = %s AND item_id = %s",
-            (new_status, purchase_id, item_id)
+            "UPDATE Purchases SET status = 'cancelled' WHERE purchase_id = %s AND item_id = %s "
+            "AND status IN ('offered', 'confirmed') AND %s IN (owner_id, buyer_id)",
+            (1, 2, "buyer1")
         )
 
-        # Ensure the transaction was committed
-        mock_transactions_conn.commit.assert_called_once()
+    @patch("irentstuff_purchase_update.retrieve_updated_purchase")
+    def test_update_db_nothing_matched(self, mock_retrieve_updated_purchase):
+        # Wrong status, wrong requestor or no such purchase
+        mock_cursor = MagicMock()
+        mock_cursor.rowcount = 0
 
-        # Check if retrieve_updated_purchase was called with correct parameters
-        mock_retrieve_updated_purchase.assert_called_once_with(mock_cursor, item_id, purchase_id)
+        purchase = update_db(mock_cursor, "confirm", "buyer1", 1, 2)
 
-        # Check the response format and content
-        self.assertEqual(response["statusCode"], 200)
-        self.assertEqual(response["headers"]["Content-Type"], "application/json")
-        self.assertIn("purchase_id", response["body"])
-        self.assertIn("status", response["body"])
-        self.assertIn("purchase_date", response["body"])
+        self.assertIsNone(purchase)
+        mock_retrieve_updated_purchase.assert_not_called()
 
 
 class TestUpdateAvailabilityInItemsDB(TestCase):
 
-    @patch("requests.patch")  # Mock the requests.patch method
+    @patch("irentstuff_purchase_update.SESSION.patch")  # Mock the pooled session's patch method
     def test_update_availability_success(self, mock_patch):
         token = "valid_token"
         item_id = "item_123"
@@ -329,7 +185,7 @@ class TestUpdateAvailabilityInItemsDB(TestCase):
         # Call the function
         result = update_availability_in_items_db(token, item_id, availability)
 
-        # Verify that requests.patch was called with the correct parameters
+        # Verify that the session's patch was called with the correct parameters
         api_url = f"https://pxgwc7gdz1.execute-api.ap-southeast-1.amazonaws.com/dev/items/{item_id}"
         expected_headers = {
             "Authorization": f"Bearer {token}",
@@ -337,13 +193,13 @@ class TestUpdateAvailabilityInItemsDB(TestCase):
         }
         expected_payload = {"availability": availability}
 
-        mock_patch.assert_called_once_with(api_url, headers=expected_headers, json=expected_payload)
+        mock_patch.assert_called_once_with(api_url, headers=expected_headers, json=expected_payload, timeout=(3, 5))
 
         # Assert that the result matches the expected response
         expected_result = {"message": "Availability updated"}
         self.assertEqual(result, expected_result)
 
-    @patch("requests.patch")  # Mock the requests.patch method
+    @patch("irentstuff_purchase_update.SESSION.patch")  # Mock the pooled session's patch method
     def test_update_availability_failure(self, mock_patch):
         token = "valid_token"
         item_id = "item_123"
@@ -365,7 +221,7 @@ class TestUpdateAvailabilityInItemsDB(TestCase):
         }
         self.assertEqual(result, expected_result)
 
-    @patch("requests.patch")  # Mock the requests.patch method
+    @patch("irentstuff_purchase_update.SESSION.patch")  # Mock the pooled session's patch method
     def test_update_availability_request_exception(self, mock_patch):
         token = "valid_token"
         item_id = "item_123"
@@ -387,178 +243,237 @@ class TestUpdateAvailabilityInItemsDB(TestCase):
 
 class TestUpdatePurchaseStatus(TestCase):
 
+    def event(self, action, token="valid_token", purchase_id="1"):
+        return {
+            "pathParameters": {
+                "item_id": "1",
+                "purchase_id": purchase_id,
+                "action": action
+            },
+            "headers": {
+                "Authorization": f"Bearer {token}"
+            }
+        }
+
+    @patch("irentstuff_purchase_update.send_message")
     @patch("irentstuff_purchase_update.update_availability_in_items_db")
     @patch("irentstuff_purchase_update.update_db")
-    @patch("irentstuff_purchase_update.invoke_auth_lambda")
-    @patch("irentstuff_purchase_update.connect_to_db")
-    def test_update_purchase_confirm_success(self, mock_connect_to_db, mock_invoke_auth_lambda, mock_update_db, mock_update_availability):
+    @patch("irentstuff_purchase_update.verify_token")
+    @patch("irentstuff_purchase_update.get_conn")
+    def test_update_purchase_confirm_success(
+            self, mock_get_conn, mock_verify_token, mock_update_db, mock_update_availability, mock_send_message):
         # Arrange
         mock_conn = MagicMock()
         mock_cursor = MagicMock()
-        mock_connect_to_db.return_value = mock_conn
+        mock_get_conn.return_value = mock_conn
         mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
 
-        # Mocking database query for fetching purchase
-        mock_cursor.fetchone.return_value = {
-            "purchase_id": 1,
-            "item_id": 1,
-            "status": "offered",
-            "owner_id": "owner1",
-            "buyer_id": "buyer1"
-        }
-
         # Mocking authentication
-        mock_invoke_auth_lambda.return_value = {
+        mock_verify_token.return_value = {
             "message": "Token is valid",
             "username": "owner1"
         }
 
-        # Mock update_db response
+        # Mock the purchase returned by update_db
         mock_update_db.return_value = {
-            "statusCode": 200,
-            "body": json.dumps({"message": "Purchase confirmed"})
-        }
-
-        event = {
-            "pathParameters": {
-                "item_id": "1",
-                "purchase_id": "1",
-                "action": "confirm"
-            },
-            "headers": {
-                "Authorization": "Bearer valid_token"
-            }
+            "purchase_id": 1,
+            "item_id": 1,
+            "status": "confirmed",
+            "owner_id": "owner1",
+            "buyer_id": "buyer1"
         }
-        context = {}
 
         # Act
-        response = update_purchase_status(event, context)
+        response = update_purchase_status(self.event("confirm"), {})
 
         # Assert
         self.assertEqual(response["statusCode"], 200)
-        self.assertIn("message", json.loads(response["body"]))
-        mock_update_db.assert_called_once_with(mock_cursor, "confirmed", "1", "1", mock_conn)
+        self.assertEqual(json.loads(response["body"])["status"], "confirmed")
+        mock_update_db.assert_called_once_with(mock_cursor, "confirm", "owner1", "1", "1")
         mock_update_availability.assert_called_once_with("valid_token", "1", availability="pending_purchase")
+        mock_send_message.assert_called_once_with({
+            "token": "valid_token",
+            "itemId": "1",
+            "ownerid": "owner1",
+            "renterId": "buyer1",
+            "username": "owner1",
+            "admin": "confirmed"
+        })
+        # A successful update needs no SELECT beyond the one update_db makes for the result
+        mock_cursor.execute.assert_not_called()
 
+    @patch("irentstuff_purchase_update.send_message")
     @patch("irentstuff_purchase_update.update_availability_in_items_db")
     @patch("irentstuff_purchase_update.update_db")
-    @patch("irentstuff_purchase_update.invoke_auth_lambda")
-    @patch("irentstuff_purchase_update.connect_to_db")
-    def test_update_purchase_cancel_success(self, mock_connect_to_db, mock_invoke_auth_lambda, mock_update_db, mock_update_availability):
+    @patch("irentstuff_purchase_update.verify_token")
+    @patch("irentstuff_purchase_update.get_conn")
+    def test_update_purchase_cancel_success(
+            self, mock_get_conn, mock_verify_token, mock_update_db, mock_update_availability, mock_send_message):
         # Arrange
         mock_conn = MagicMock()
         mock_cursor = MagicMock()
-        mock_connect_to_db.return_value = mock_conn
+        mock_get_conn.return_value = mock_conn
         mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
 
-        # Mocking database query for fetching purchase
-        mock_cursor.fetchone.return_value = {
-            "purchase_id": 1,
-            "item_id": 1,
-            "status": "offered",
-            "owner_id": "owner1",
-            "buyer_id": "buyer1"
-        }
-
         # Mocking authentication
-        mock_invoke_auth_lambda.return_value = {
+        mock_verify_token.return_value = {
             "message": "Token is valid",
             "username": "buyer1"
         }
 
-        # Mock update_db response
+        # Mock the purchase returned by update_db
         mock_update_db.return_value = {
-            "statusCode": 200,
-            "body": json.dumps({"message": "Purchase cancelled"})
-        }
-
-        event = {
-            "pathParameters": {
-                "item_id": "1",
-                "purchase_id": "1",
-                "action": "cancel"
-            },
-            "headers": {
-                "Authorization": "Bearer valid_token"
-            }
+            "purchase_id": 1,
+            "item_id": 1,
+            "status": "cancelled",
+            "owner_id": "owner1",
+            "buyer_id": "buyer1"
         }
-        context = {}
 
         # Act
-        response = update_purchase_status(event, context)
+        response = update_purchase_status(self.event("cancel"), {})
 
         # Assert
         self.assertEqual(response["statusCode"], 200)
-        self.assertIn("message", json.loads(response["body"]))
-        mock_update_db.assert_called_once_with(mock_cursor, "cancelled", "1", "1", mock_conn)
+        self.assertEqual(json.loads(response["body"])["status"], "cancelled")
+        mock_update_db.assert_called_once_with(mock_cursor, "cancel", "buyer1", "1", "1")
         mock_update_availability.assert_called_once_with("valid_token", "1", availability="available")
+        self.assertEqual(mock_send_message.call_args[0][0]["username"], "buyer1")
 
-    @patch("irentstuff_purchase_update.invoke_auth_lambda")
-    @patch("irentstuff_purchase_update.connect_to_db")
-    def test_update_purchase_invalid_token(self, mock_connect_to_db, mock_invoke_auth_lambda):
-        # Arrange
+    @patch("irentstuff_purchase_update.send_message")
+    @patch("irentstuff_purchase_update.update_availability_in_items_db")
+    @patch("irentstuff_purchase_update.update_db")
+    @patch("irentstuff_purchase_update.verify_token")
+    @patch("irentstuff_purchase_update.get_conn")
+    def test_update_purchase_formats_dates_and_prices(self, mock_get_conn, mock_verify_token, mock_update_db, *_):
+        mock_verify_token.return_value = {"message": "Token is valid", "username": "owner1"}
+        # update_db hands back the row as pymysql returns it
+        mock_update_db.return_value = {
+            "purchase_id": 1,
+            "owner_id": "owner1",
+            "buyer_id": "buyer1",
+            "status": "sold",
+            "purchase_price": Decimal("15.00"),
+            "purchase_date": datetime(2023, 11, 5, 16, 45, 0),
+            "created_at": datetime(2023, 10, 1, 14, 30, 0)
+        }
+
+        response = update_purchase_status(self.event("complete"), {})
+
+        body = json.loads(response["body"])
+        self.assertEqual(body["purchase_price"], 15.0)
+        self.assertEqual(body["purchase_date"], "2023-11-05T16:45:00")
+        self.assertEqual(body["created_at"], "2023-10-01T14:30:00")
+        self.assertNotIn(" ", response["body"])
+
+    @patch("irentstuff_purchase_update.update_availability_in_items_db")
+    @patch("irentstuff_purchase_update.update_db", return_value=None)
+    @patch("irentstuff_purchase_update.verify_token")
+    @patch("irentstuff_purchase_update.get_conn")
+    def test_update_purchase_requestor_not_allowed(self, mock_get_conn, mock_verify_token, mock_update_db, mock_update_availability):
         mock_conn = MagicMock()
-        mock_connect_to_db.return_value = mock_conn
+        mock_cursor = MagicMock()
+        mock_get_conn.return_value = mock_conn
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
 
-        # Mocking invalid token response
-        mock_invoke_auth_lambda.return_value = {
-            "message": "Token is invalid",
-            "username": None
+        # The purchase can be confirmed, just not by the buyer
+        mock_cursor.fetchone.return_value = {"status": "offered"}
+        mock_verify_token.return_value = {
+            "message": "Token is valid",
+            "username": "buyer1"
         }
 
-        event = {
-            "pathParameters": {
-                "item_id": "1",
-                "purchase_id": "1",
-                "action": "confirm"
-            },
-            "headers": {
-                "Authorization": "Bearer invalid_token"
-            }
+        response = update_purchase_status(self.event("confirm"), {})
+
+        self.assertEqual(response["statusCode"], 401)
+        self.assertEqual(response["body"], "Only the item owner can confirm the purchase request.")
+        mock_update_availability.assert_not_called()
+
+    @patch("irentstuff_purchase_update.update_db", return_value=None)
+    @patch("irentstuff_purchase_update.verify_token")
+    @patch("irentstuff_purchase_update.get_conn")
+    def test_update_purchase_invalid_transition(self, mock_get_conn, mock_verify_token, mock_update_db):
+        mock_conn = MagicMock()
+        mock_cursor = MagicMock()
+        mock_get_conn.return_value = mock_conn
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+
+        mock_cursor.fetchone.return_value = {"status": "sold"}
+        mock_verify_token.return_value = {
+            "message": "Token is valid",
+            "username": "owner1"
         }
-        context = {}
+
+        response = update_purchase_status(self.event("confirm"), {})
+
+        self.assertEqual(response["statusCode"], 400)
+        self.assertEqual(
+            response["body"],
+            "Cannot perform 'confirm' update on Item ID '1' with Purchase ID '1' because the current status is 'sold'."
+        )
+
+    @patch("irentstuff_purchase_update.update_db")
+    @patch("irentstuff_purchase_update.verify_token")
+    @patch("irentstuff_purchase_update.get_conn")
+    def test_update_purchase_unknown_action(self, mock_get_conn, mock_verify_token, mock_update_db):
+        mock_conn = MagicMock()
+        mock_cursor = MagicMock()
+        mock_get_conn.return_value = mock_conn
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+
+        mock_cursor.fetchone.return_value = {"status": "offered"}
+        mock_verify_token.return_value = {
+            "message": "Token is valid",
+            "username": "owner1"
+        }
+
+        response = update_purchase_status(self.event("resell"), {})
+
+        self.assertEqual(response["statusCode"], 400)
+        mock_update_db.assert_not_called()
+
+    @patch("irentstuff_purchase_update.verify_token")
+    @patch("irentstuff_purchase_update.get_conn")
+    def test_update_purchase_invalid_token(self, mock_get_conn, mock_verify_token):
+        # Arrange
+        # Mocking invalid token response
+        mock_verify_token.side_effect = Exception("Signature verification failed.")
 
         # Act
-        response = update_purchase_status(event, context)
+        response = update_purchase_status(self.event("confirm", token="invalid_token"), {})
 
         # Assert
         self.assertEqual(response["statusCode"], 401)
         self.assertEqual(response["body"], "Your user token is invalid.")
-
-    @patch("irentstuff_purchase_update.invoke_auth_lambda")
-    @patch("irentstuff_purchase_update.connect_to_db")
-    def test_update_purchase_not_found(self, mock_connect_to_db, mock_invoke_auth_lambda):
+        mock_verify_token.assert_called_once_with("invalid_token")
+        # A rejected token never reaches the DB
+        mock_get_conn.assert_not_called()
+
+    @patch("irentstuff_purchase_update.update_db", return_value=None)
+    @patch("irentstuff_purchase_update.verify_token")
+    @patch("irentstuff_purchase_update.get_conn")
+    def test_update_purchase_not_found(self, mock_get_conn, mock_verify_token, mock_update_db):
         # Arrange
         mock_conn = MagicMock()
         mock_cursor = MagicMock()
-        mock_connect_to_db.return_value = mock_conn
+        mock_get_conn.return_value = mock_conn
         mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
 
         # Mocking database query for no purchase found
         mock_cursor.fetchone.return_value = None
 
         # Mocking authentication
-        mock_invoke_auth_lambda.return_value = {
+        mock_verify_token.return_value = {
             "message": "Token is valid",
             "username": "buyer1"
         }
 
-        event = {
-            "pathParameters": {
-                "item_id": "1",
-                "purchase_id": "999",
-                "action": "confirm"
-            },
-            "headers": {
-                "Authorization": "Bearer valid_token"
-            }
-        }
-        context = {}
-
         # Act
-        response = update_purchase_status(event, context)
-        print(response)
+        response = update_purchase_status(self.event("confirm", purchase_id="999"), {})
 
         # Assert
         self.assertEqual(response["statusCode"], 404)
         self.assertEqual(response["body"], "Purchase ID 999 with Item ID 1 not found.")
+        # The connection is kept open for the next warm invocation, and autocommits so is never committed explicitly
+        mock_conn.close.assert_not_called()
+        mock_conn.commit.assert_not_called()
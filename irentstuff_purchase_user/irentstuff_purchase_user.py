@@ -4,95 +4,112 @@ import json
 import logging
 import pymysql
 import os
-import sys
-from pymysql.cursors import DictCursor
+
+from irentstuff_common.db import get_conn
 
 log = logging.getLogger()
-log.setLevel(logging.INFO)
+# WARNING by default: CloudWatch bills per GB ingested and formatting log lines costs CPU on every request.
+# Set LOG_LEVEL=INFO or DEBUG on the function to get the detailed logs back while debugging
+log.setLevel(os.environ.get("LOG_LEVEL", "WARNING"))
 
+# Built once per container: json.dumps() constructs a new JSONEncoder on every call that passes default=.
+# default=str handles date/decimal formatting, compact separators trim the payload
+_ROWS_ENCODER = json.JSONEncoder(default=str, separators=(",", ":"))
 
-def connect_to_db():
-    "Connect to Transactions DB"
-    transactions_conn = None
-    transactions_db_user_name = os.environ["DB1_USER_NAME"]
-    transactions_db_password = os.environ["DB1_PASSWORD"]
-    transactions_db_rds_proxy_host = os.environ["DB1_RDS_PROXY_HOST"]
-    transactions_db_name = os.environ["DB1_NAME"]
+# Page size used when the request doesn't pass ?limit=, so a heavy user's history is never loaded in one go
+DEFAULT_PAGE_SIZE = 50
+# Larger ?limit= values are clamped to this so a single request stays bounded
+MAX_PAGE_SIZE = 100
 
-    try:
-        transactions_conn = pymysql.connect(
-            host=transactions_db_rds_proxy_host,
-            user=transactions_db_user_name,
-            passwd=transactions_db_password,
-            db=transactions_db_name,
-            connect_timeout=5,
-            cursorclass=DictCursor
-        )
-        log.info("SUCCESS: Connection to Transactions DB succeeded")
-    except pymysql.MySQLError as e:
-        log.error("ERROR: Unexpected error: Could not connect to MySQL instance.")
-        log.error(e)
-        sys.exit(1)
-    return transactions_conn
+PURCHASE_COLUMNS = "purchase_id, created_at, updated_at, owner_id, buyer_id, item_id, purchase_date, status, purchase_price"
+
+# Served by the idx_purchases_owner_id/idx_purchases_buyer_id indexes. irentstuff_purchase_add creates them with a new
+# table and adds them to an existing one on its first cold start (ensure_indexes); until then these queries scan the table.
+# InnoDB appends the primary key to secondary indexes, so seeking past purchase_id is an index range scan
+# with no filesort, where OFFSET would make MySQL read and discard every earlier row
+_SQL_PURCHASES_AS_OWNER = f"SELECT {PURCHASE_COLUMNS} FROM Purchases WHERE owner_id = %s AND purchase_id > %s ORDER BY purchase_id LIMIT %s"
+_SQL_PURCHASES_AS_BUYER = f"SELECT {PURCHASE_COLUMNS} FROM Purchases WHERE buyer_id = %s AND purchase_id > %s ORDER BY purchase_id LIMIT %s"
+
+
+_CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET, OPTIONS",
+    "Access-Control-Allow-Headers": "Content-Type"
+}
+# Built once per container; callers only read these, so every response can share the same dicts
+_JSON_HEADERS = {**_CORS_HEADERS, "Content-Type": "application/json"}
+_TEXT_HEADERS = {**_CORS_HEADERS, "Content-Type": "text/plain"}
 
 
 def response_header(content_type: str):
-    header = {
-        "Access-Control-Allow-Origin": "*",
-        "Access-Control-Allow-Methods": "GET, OPTIONS",
-        "Access-Control-Allow-Headers": "Content-Type",
-        "Content-Type": content_type
-    }
-    return header
+    if content_type == "application/json":
+        return _JSON_HEADERS
+    if content_type == "text/plain":
+        return _TEXT_HEADERS
+    return {**_CORS_HEADERS, "Content-Type": content_type}
+
+
+def get_page(query_params):
+    """Read the limit/cursor query strings, defaulting to the first page. cursor is the last purchase_id of the previous page.
+    limit is clamped to MAX_PAGE_SIZE. Raises ValueError if either is not a valid number"""
+    limit = int(query_params.get("limit", DEFAULT_PAGE_SIZE))
+    cursor = int(query_params.get("cursor", 0))
+    if limit < 1 or cursor < 0:
+        raise ValueError(f"limit must be positive and cursor non-negative, got limit={limit}, cursor={cursor}")
+    return min(limit, MAX_PAGE_SIZE), cursor
 
 
 def get_user_purchases(event, context):
-    log.info(event)
-    transactions_conn = connect_to_db()
+    log.debug(event)
 
     user_id = event["pathParameters"]["user_id"]
-    query_params = event.get("queryStringParameters", {})
-    as_role = query_params.get("as", {}) if query_params else None
-    log.info(f"Getting all purchases as {as_role} for {user_id}")
+    # API Gateway sends null rather than omitting the key when there is no query string
+    query_params = event.get("queryStringParameters") or {}
+    as_role = query_params.get("as")
 
+    # Bad query strings are rejected before get_conn(), so they never cost a DB round trip
+    try:
+        limit, after = get_page(query_params)
+    except ValueError as e:
+        return {
+            "statusCode": 400,
+            "headers": _TEXT_HEADERS,
+            "body": f"Unable to get purchases related to {user_id}. 'limit' and 'cursor' query strings should be whole numbers: {str(e)}"
+        }
+    if as_role == "owner":
+        sql = _SQL_PURCHASES_AS_OWNER
+    elif as_role == "buyer":
+        sql = _SQL_PURCHASES_AS_BUYER
+    else:
+        return {
+            "statusCode": 400,
+            "headers": _TEXT_HEADERS,
+            "body": f"Unable to get purchases related to {user_id}. 'as' query string should be 'owner' or 'buyer'."
+        }
+    log.info("Getting up to %d purchases after %d as %s for %s", limit, after, as_role, user_id)
+
+    transactions_conn = get_conn()
     try:
         with transactions_conn.cursor(pymysql.cursors.DictCursor) as cursor:
             if user_id:
-                if as_role == "owner":
-                    select_query = "SELECT * FROM Purchases WHERE owner_id = %s"
-                    cursor.execute(select_query, user_id)
-                elif as_role == "buyer":
-                    select_query = "SELECT * FROM Purchases WHERE buyer_id = %s"
-                    cursor.execute(select_query, user_id)
-                else:
-                    return {
-                        "statusCode": 400,
-                        "headers": response_header('text/plain'),
-                        "body": f"Unable to get purchases related to {user_id}. 'as' query string should be 'owner' or 'buyer'."
-                    }
-
+                # One row past the page tells us whether there is a next page without a COUNT(*) query
+                cursor.execute(sql, (user_id, after, limit + 1))
                 purchases = cursor.fetchall()
+                log.debug("Fetched %d purchases as %s for %s", len(purchases), as_role, user_id)
+
+                next_cursor = None
+                if len(purchases) > limit:
+                    purchases = purchases[:limit]
+                    next_cursor = purchases[-1]["purchase_id"]
 
-                if purchases:
-                    for purchase in purchases:
-                        log.info(purchase)
-
-                    return {
-                        "statusCode": 200,
-                        "headers": response_header('application/json'),
-                        "body": json.dumps(purchases, default=str)  # default=str handles date/decimal formatting
-                    }
-                else:
-                    return {
-                        "statusCode": 200,
-                        "headers": response_header('application/json'),
-                        "body": json.dumps([])  # Return an empty array if no rentals found
-                    }
+                return {
+                    "statusCode": 200,
+                    "headers": _JSON_HEADERS,
+                    "body": _ROWS_ENCODER.encode({"items": purchases, "next_cursor": next_cursor})
+                }
     except pymysql.MySQLError as e:
         return {
             "statusCode": 500,
-            "headers": response_header('text/plain'),
+            "headers": _TEXT_HEADERS,
             "body": f"An error occurred while retrieving the purchases: {str(e)}"
         }
-    finally:
-        transactions_conn.close()
@@ -1,60 +1,18 @@
 import json
-import os
 import pymysql
 
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
+
 from irentstuff_purchase_user import (
-    connect_to_db,
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    PURCHASE_COLUMNS,
     response_header,
     get_user_purchases
 )
 
 
-class TestConnectToDB(TestCase):
-    @classmethod
-    def setUpClass(cls):
-        # Set up environment variables for testing
-        os.environ["DB1_USER_NAME"] = "test_user"
-        os.environ["DB1_PASSWORD"] = "test_password"
-        os.environ["DB1_RDS_PROXY_HOST"] = "test_host"
-        os.environ["DB1_NAME"] = "test_db"
-
-    @patch("pymysql.connect")
-    def test_connect_to_db_success(self, mock_connect):
-        # Mock the connection object
-        mock_conn = MagicMock()
-        mock_connect.return_value = mock_conn
-
-        # Call the function
-        result = connect_to_db()
-
-        # Assert that the connect function was called with the expected arguments
-        mock_connect.assert_called_once_with(
-            host=os.environ["DB1_RDS_PROXY_HOST"],
-            user=os.environ["DB1_USER_NAME"],
-            passwd=os.environ["DB1_PASSWORD"],
-            db=os.environ["DB1_NAME"],
-            connect_timeout=5,
-            cursorclass=pymysql.cursors.DictCursor
-        )
-
-        # Assert that the returned connection is the mocked connection
-        self.assertEqual(result, mock_conn)
-
-    @patch("pymysql.connect")
-    @patch("sys.exit")  # Mock sys.exit to prevent the script from exiting
-    def test_connect_to_db_failure(self, mock_exit, mock_connect):
-        # Simulate a MySQL error when trying to connect
-        mock_connect.side_effect = pymysql.MySQLError("Connection error")
-
-        # Call the function (no need to expect SystemExit since we're mocking sys.exit)
-        connect_to_db()
-
-        # Assert that sys.exit was called with the correct exit code
-        mock_exit.assert_called_once_with(1)
-
-
 class TestResponseHeader:
     def test_response_header(self):
         # Test case for when content_type is 'application/json'
@@ -86,7 +44,7 @@ class TestResponseHeader:
 
 
 class TestGetUserPurchases(TestCase):
-    @patch("irentstuff_purchase_user.connect_to_db")
+    @patch("irentstuff_purchase_user.get_conn")
     def test_get_user_purchases_success_as_owner(self, mock_connect):
         # Arrange
         mock_conn = MagicMock()
@@ -109,14 +67,16 @@ class TestGetUserPurchases(TestCase):
 
         # Assert
         self.assertEqual(response["statusCode"], 200)
-        self.assertEqual(json.loads(response["body"]), purchases_data)
+        self.assertEqual(json.loads(response["body"]), {"items": purchases_data, "next_cursor": None})
 
         mock_cursor.execute.assert_called_once_with(
-            "SELECT * FROM Purchases WHERE owner_id = %s", user_id
+            f"SELECT {PURCHASE_COLUMNS} FROM Purchases WHERE owner_id = %s AND purchase_id > %s ORDER BY purchase_id LIMIT %s",
+            (user_id, 0, DEFAULT_PAGE_SIZE + 1)
         )
-        mock_conn.close.assert_called_once()
+        # The connection is kept open for the next warm invocation
+        mock_conn.close.assert_not_called()
 
-    @patch("irentstuff_purchase_user.connect_to_db")
+    @patch("irentstuff_purchase_user.get_conn")
     def test_get_user_purchases_success_as_buyer(self, mock_connect):
         # Arrange
         mock_conn = MagicMock()
@@ -139,14 +99,16 @@ class TestGetUserPurchases(TestCase):
 
         # Assert
         self.assertEqual(response["statusCode"], 200)
-        self.assertEqual(json.loads(response["body"]), purchases_data)
+        self.assertEqual(json.loads(response["body"]), {"items": purchases_data, "next_cursor": None})
 
         mock_cursor.execute.assert_called_once_with(
-            "SELECT * FROM Purchases WHERE buyer_id = %s", user_id
+            f"SELECT {PURCHASE_COLUMNS} FROM Purchases WHERE buyer_id = %s AND purchase_id > %s ORDER BY purchase_id LIMIT %s",
+            (user_id, 0, DEFAULT_PAGE_SIZE + 1)
         )
-        mock_conn.close.assert_called_once()
+        # The connection is kept open for the next warm invocation
+        mock_conn.close.assert_not_called()
 
-    @patch("irentstuff_purchase_user.connect_to_db")
+    @patch("irentstuff_purchase_user.get_conn")
     def test_get_user_purchases_no_purchases(self, mock_connect):
         # Arrange
         mock_conn = MagicMock()
@@ -168,14 +130,16 @@ class TestGetUserPurchases(TestCase):
 
         # Assert
         self.assertEqual(response["statusCode"], 200)
-        self.assertEqual(json.loads(response["body"]), [])  # Expecting an empty array
+        self.assertEqual(json.loads(response["body"]), {"items": [], "next_cursor": None})
 
         mock_cursor.execute.assert_called_once_with(
-            "SELECT * FROM Purchases WHERE owner_id = %s", user_id
+            f"SELECT {PURCHASE_COLUMNS} FROM Purchases WHERE owner_id = %s AND purchase_id > %s ORDER BY purchase_id LIMIT %s",
+            (user_id, 0, DEFAULT_PAGE_SIZE + 1)
         )
-        mock_conn.close.assert_called_once()
+        # The connection is kept open for the next warm invocation
+        mock_conn.close.assert_not_called()
 
-    @patch("irentstuff_purchase_user.connect_to_db")
+    @patch("irentstuff_purchase_user.get_conn")
     def test_get_user_purchases_invalid_role(self, mock_connect):
         # Arrange
         mock_conn = MagicMock()
@@ -196,10 +160,9 @@ class TestGetUserPurchases(TestCase):
         # Assert
         self.assertEqual(response["statusCode"], 400)
         self.assertIn("Unable to get purchases related to", response["body"])
+        mock_connect.assert_not_called()
 
-        mock_conn.close.assert_called_once()
-
-    @patch("irentstuff_purchase_user.connect_to_db")
+    @patch("irentstuff_purchase_user.get_conn")
     def test_get_user_purchases_db_error(self, mock_connect):
         # Mock the connection and cursor
         mock_conn = MagicMock()
@@ -218,3 +181,98 @@ class TestGetUserPurchases(TestCase):
 
         self.assertEqual(response["statusCode"], 500)
         self.assertIn("An error occurred while retrieving the purchases:", response["body"])
+
+    @patch("irentstuff_purchase_user.get_conn")
+    def test_get_user_purchases_paginated(self, mock_connect):
+        # Arrange
+        mock_conn = MagicMock()
+        mock_cursor = MagicMock()
+        mock_connect.return_value = mock_conn
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+
+        user_id = "test_buyer_id"
+        # One more row than the page size means there is a next page
+        mock_cursor.fetchall.return_value = [{"purchase_id": purchase_id, "buyer_id": user_id} for purchase_id in (11, 12, 13)]
+
+        event = {
+            "pathParameters": {"user_id": user_id},
+            "queryStringParameters": {"as": "buyer", "limit": "2", "cursor": "10"}
+        }
+        context = {}
+
+        # Act
+        response = get_user_purchases(event, context)
+
+        # Assert
+        self.assertEqual(response["statusCode"], 200)
+        body = json.loads(response["body"])
+        self.assertEqual([purchase["purchase_id"] for purchase in body["items"]], [11, 12])
+        self.assertEqual(body["next_cursor"], 12)
+        mock_cursor.execute.assert_called_once_with(
+            f"SELECT {PURCHASE_COLUMNS} FROM Purchases WHERE buyer_id = %s AND purchase_id > %s ORDER BY purchase_id LIMIT %s", (user_id, 10, 3)
+        )
+
+    @patch("irentstuff_purchase_user.get_conn")
+    def test_get_user_purchases_limit_capped(self, mock_connect):
+        # Arrange
+        mock_conn = MagicMock()
+        mock_cursor = MagicMock()
+        mock_connect.return_value = mock_conn
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+
+        user_id = "test_owner_id"
+        mock_cursor.fetchall.return_value = []
+
+        event = {
+            "pathParameters": {"user_id": user_id},
+            "queryStringParameters": {"as": "owner", "limit": "5000"}
+        }
+        context = {}
+
+        # Act
+        response = get_user_purchases(event, context)
+
+        # Assert
+        self.assertEqual(response["statusCode"], 200)
+        mock_cursor.execute.assert_called_once_with(
+            f"SELECT {PURCHASE_COLUMNS} FROM Purchases WHERE owner_id = %s AND purchase_id > %s ORDER BY purchase_id LIMIT %s",
+            (user_id, 0, MAX_PAGE_SIZE + 1)
+        )
+
+    @patch("irentstuff_purchase_user.get_conn")
+    def test_get_user_purchases_invalid_page(self, mock_connect):
+        # Arrange
+        mock_conn = MagicMock()
+        mock_cursor = MagicMock()
+        mock_connect.return_value = mock_conn
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+
+        event = {
+            "pathParameters": {"user_id": "test_owner_id"},
+            "queryStringParameters": {"as": "owner", "limit": "all"}
+        }
+        context = {}
+
+        # Act
+        response = get_user_purchases(event, context)
+
+        # Assert
+        self.assertEqual(response["statusCode"], 400)
+        self.assertIn("'limit' and 'cursor' query strings should be whole numbers", response["body"])
+        mock_connect.assert_not_called()
+
+    @patch("irentstuff_purchase_user.get_conn")
+    def test_get_user_purchases_no_query_string(self, mock_connect):
+        # Arrange
+        mock_connect.return_value = MagicMock()
+
+        event = {"pathParameters": {"user_id": "test_owner_id"}, "queryStringParameters": None}
+        context = {}
+
+        # Act
+        response = get_user_purchases(event, context)
+
+        # Assert
+        self.assertEqual(response["statusCode"], 400)
+        self.assertIn("'as' query string should be 'owner' or 'buyer'", response["body"])
+        mock_connect.assert_not_called()
@@ -17,76 +17,80 @@ If conflict, return error message
 3. If an offer has been made by the renter for the same period, a second offer should not be allowed.
 """
 
-import boto3
 import json
 import logging
 import os
 import pymysql
-import requests
-import sys
 
-from datetime import datetime, date
-from websocket import create_connection
+from datetime import datetime
+from irentstuff_common.auth import verify_token
+from irentstuff_common.db import ensure_indexes, get_conn
+from irentstuff_common.headers import JSON_HEADERS, TEXT_HEADERS
+from irentstuff_common.items import get_item, invalidate_item
 
 log = logging.getLogger()
-log.setLevel(logging.INFO)
-
-lambda_client = boto3.client('lambda', region_name="ap-southeast-1")
-
-
-def invoke_auth_lambda(jwt_token):
-    # Prepare the payload to send to the authentication Lambda
-    payload = {
-        "headers": {
-            "Authorization": jwt_token
-        }
-    }
-
-    # Invoke the authentication Lambda function
-    response = lambda_client.invoke(
-        FunctionName='irentstuff-authenticate-user',  # Replace with the actual Lambda function name
-        InvocationType='RequestResponse',  # Synchronous invocation
-        Payload=json.dumps(payload)
+# WARNING by default: CloudWatch bills per GB ingested and formatting log lines costs CPU on every request.
+# Set LOG_LEVEL=INFO or DEBUG on the function to get the detailed logs back while debugging
+log.setLevel(os.environ.get("LOG_LEVEL", "WARNING"))
+
+# The tables only need creating once, so warm invocations skip the CREATE TABLE IF NOT EXISTS round trip
+_schema_ready = False
+
+# SQL is kept at module scope so statements are built once per container. They are deliberately not server-side
+# PREPAREd: RDS Proxy pins the client to one DB connection for the rest of the session once a statement is prepared
+_SQL_CREATE_RENTALS_TABLE = """
+    CREATE TABLE IF NOT EXISTS Rentals (
+        rental_id INT AUTO_INCREMENT PRIMARY KEY,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        owner_id VARCHAR(255) NOT NULL,
+        renter_id VARCHAR(255) NOT NULL,
+        item_id INT NOT NULL,
+        start_date DATE NOT NULL,
+        end_date DATE NOT NULL,
+        status VARCHAR(255) NOT NULL,
+        price_per_day DECIMAL(10, 2) NOT NULL,
+        deposit DECIMAL(10, 2) NOT NULL,
+        INDEX idx_rentals_item_status (item_id, status),
+        INDEX idx_rentals_owner_id (owner_id),
+        INDEX idx_rentals_renter_id (renter_id)
     )
+"""
 
-    # Read the response from the invoked function
-    response_payload = json.loads(response['Payload'].read())
-    log.info(response_payload)
-
-    # Process the response based on the status code
-    if response['StatusCode'] == 200:
-        # The authentication Lambda responded successfully
-        return json.loads(response_payload.get('body'))
-    else:
-        # Handle the case where the authentication failed
-        raise Exception(f"Authentication failed: {response_payload.get('body')}")
-
-
-def connect_to_db():
-    "Connect to Transactions DB"
-    transactions_conn = None
-    transactions_db_user_name = os.environ["DB1_USER_NAME"]
-    transactions_db_password = os.environ["DB1_PASSWORD"]
-    transactions_db_rds_proxy_host = os.environ["DB1_RDS_PROXY_HOST"]
-    transactions_db_name = os.environ["DB1_NAME"]
+# The same indexes as the DDL above, for tables that existed before they were added to it. See ensure_indexes()
+_RENTALS_INDEXES = {
+    "idx_rentals_item_status": "CREATE INDEX idx_rentals_item_status ON Rentals (item_id, status)",
+    "idx_rentals_owner_id": "CREATE INDEX idx_rentals_owner_id ON Rentals (owner_id)",
+    "idx_rentals_renter_id": "CREATE INDEX idx_rentals_renter_id ON Rentals (renter_id)",
+}
+
+# Inserts the offer only if no rental is blocking the item. Doing the check inside the INSERT makes it one round trip
+# and closes the gap where a rental could be added between a separate check and the insert
+_SQL_INSERT_RENTAL = """
+    INSERT INTO Rentals (
+        owner_id, renter_id, item_id, start_date, end_date, status,
+        price_per_day, deposit
+    )
+    SELECT %s, %s, %s, %s, %s, %s, %s, %s
+    FROM DUAL
+    WHERE NOT EXISTS (
+        SELECT 1 FROM Rentals
+        WHERE item_id = %s AND status IN ('confirmed', 'ongoing')
+    )
+"""
 
-    try:
-        transactions_conn = pymysql.connect(
-            host=transactions_db_rds_proxy_host,
-            user=transactions_db_user_name,
-            passwd=transactions_db_password,
-            db=transactions_db_name,
-            connect_timeout=5)
-        log.info("SUCCESS: Connection to Transactions DB succeeded")
-    except pymysql.MySQLError as e:
-        log.error("ERROR: Unexpected error: Could not connect to MySQL instance.")
-        log.error(e)
-        log.error("Exiting due to connection failure.")
-        sys.exit(1)
-    return transactions_conn
+# Reads the new row back by primary key, so the response carries what MySQL stored: the generated created_at/updated_at,
+# dates normalised to DATE and prices rounded to DECIMAL(10, 2), rather than the raw request values
+_SQL_SELECT_RENTAL = """
+    SELECT rental_id, owner_id, renter_id, item_id, start_date, end_date, status, price_per_day, deposit, created_at, updated_at
+    FROM Rentals WHERE rental_id = %s
+"""
 
 
 def send_message(content):
+    # Only successful offers notify anyone, so requests turned away earlier never pay for importing websocket-client
+    from websocket import create_connection
+
     try:
         token = content.get("token")
         ws = create_connection(f"wss://6z72j61l2b.execute-api.ap-southeast-1.amazonaws.com/dev/?token={token}")
@@ -99,14 +103,14 @@ def send_message(content):
             "ownerid": content.get("ownerid"),
             "renterid": content.get("renterId"),
             "sender": content.get("username"),
-            "timestamp": datetime.utcnow().isoformat(),
+            "timestamp": datetime.now().isoformat(),
             "admin": "offered"
         }
-        log.info(json.dumps(message))
-        ws.send(json.dumps(message))
+        payload = json.dumps(message, separators=(",", ":"))  # Serialise once for both the log line and the send
+        log.info(payload)
+        ws.send(payload)
         log.info("Message sent")
-        result = ws.recv()
-        log.info("Received '%s'" % result)
+        # Don't wait for the echo: the caller's response doesn't depend on it, and the frame is already on its way
         ws.close()
         log.info("Message successfully sent!")
 
@@ -122,135 +126,63 @@ def send_message(content):
         }
 
 
-def response_headers(content_type: str):
-    headers = {
-        'Access-Control-Allow-Origin': '*',
-        'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-        'Access-Control-Allow-Headers': 'Content-Type',
-        'Content-Type': content_type
-    }
-    return headers
-
+def create_rental_table(transactions_conn):
+    # Create the table if it doesn't exist, and add any index an older copy of it is missing
+    with transactions_conn.cursor() as cur:
+        cur.execute(_SQL_CREATE_RENTALS_TABLE)
+        ensure_indexes(cur, "Rentals", _RENTALS_INDEXES)
 
-def get_item(item_id):
-    """Gets item details from the item DB via API"""
 
-    api_url = f"https://pxgwc7gdz1.execute-api.ap-southeast-1.amazonaws.com/dev/items/{item_id}"
+def create_rental_entry(transactions_conn, body, item_id):
+    users = body.get("users") or {}
+    rental_details = body.get("rental_details") or {}
 
     try:
-        response = requests.get(api_url)
-
-        if response.status_code == 200:
-            return response.json()
-        else:
-            return {
-                "status_code": response.status_code,
-                "body": response.text
-            }
-
-    except requests.exceptions.RequestException as e:
+        values = (
+            users["owner_id"],
+            users["renter_id"],
+            item_id,
+            rental_details["start_date"],
+            rental_details["end_date"],
+            "offered",
+            float(rental_details["price_per_day"]),
+            float(rental_details["deposit"]),
+        )
+    except (KeyError, TypeError, ValueError) as e:
+        log.error("Invalid rental request body: %r", e)
         return {
-            "status_code": 500,
-            "body": f"Error occurred while making API call: {str(e)}"
+            "statusCode": 400,
+            "headers": TEXT_HEADERS,
+            "body": f"Missing or invalid field in request body: {e}"
         }
 
-
-def check_item_rental_status(transactions_conn, item_id):
-    log.info(f"Checking for active rentals for item {item_id}")
-    try:
-        with transactions_conn.cursor() as cursor:
-            sql_query = """
-                SELECT * FROM Rentals
-                WHERE item_id = %s AND status NOT IN ('offered', 'cancelled', 'completed')
-            """
-            cursor.execute(sql_query, (item_id,))
-            results = cursor.fetchall()
-            log.info(f"Active rentals: {results}")
-
-            if results:
-                return {
-                    "status_code": 403,
-                    "body": f"Active rentals found for item_id {item_id}: {results}"
-                }
-            else:
-                return {
-                    "status_code": 200,
-                    "body": f"No active rentals found for item_id {item_id}"
-                }
-    except pymysql.MySQLError as e:
-        return {
-            "status_code": 500,
-            "body": f"An error occurred while querying the database: {str(e)}"
-        }
-
-
-def create_rental_table(transactions_conn):
-    create_table_sql = """
-        CREATE TABLE IF NOT EXISTS Rentals (
-            rental_id INT AUTO_INCREMENT PRIMARY KEY,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-            owner_id VARCHAR(255) NOT NULL,
-            renter_id VARCHAR(255) NOT NULL,
-            item_id INT NOT NULL,
-            start_date DATE NOT NULL,
-            end_date DATE NOT NULL,
-            status VARCHAR(255) NOT NULL,
-            price_per_day DECIMAL(10, 2) NOT NULL,
-            deposit DECIMAL(10, 2) NOT NULL
-        )
-    """
-    # Create the table if it doesn't exist
-    with transactions_conn.cursor() as cur:
-        cur.execute(create_table_sql)
-        transactions_conn.commit()
-
-
-def create_rental_entry(transactions_conn, event, item_id):
-    body = json.loads(event['body'])
-    users = body["users"]
-    rental_details = body["rental_details"]
-
-    # Create rental variables
-    sql_string = """
-        INSERT INTO Rentals (
-            owner_id, renter_id, item_id, start_date, end_date, status,
-            price_per_day, deposit
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-    """
-
-    values = (
-        users["owner_id"],
-        users["renter_id"],
-        item_id,
-        rental_details["start_date"],
-        rental_details["end_date"],
-        "offered",
-        float(rental_details["price_per_day"]),
-        float(rental_details["deposit"]),
-    )
-
-    log.info(f"Will insert:\n{values}")
+    log.debug("Will insert:\n%s", values)
 
     try:
         with transactions_conn.cursor(pymysql.cursors.DictCursor) as cur:
-            # Insert the entry
-            cur.execute(sql_string, values)
-            transactions_conn.commit()
+            # Insert the entry, unless the item has a blocking rental. A single statement, so autocommit keeps it atomic
+            cur.execute(_SQL_INSERT_RENTAL, values + (item_id,))
 
-            # Get the rental_id of the newly inserted entry
-            cur.execute("SELECT LAST_INSERT_ID() as rental_id")
-            rental_id = cur.fetchone()["rental_id"]
-            log.info(f"New rental_id is {rental_id}")
+            if cur.rowcount == 0:
+                log.info("Active rentals found for item_id %s. No rental created.", item_id)
+                return {
+                    "statusCode": 403,
+                    "headers": JSON_HEADERS,
+                    "body": json.dumps({
+                        "message": f"Active rentals found for item_id {item_id}"
+                    }, separators=(",", ":"))
+                }
 
-            # Get details of the newly inserted entry
-            cur.execute("SELECT * FROM Rentals WHERE rental_id = %s", (rental_id,))
-            rental = cur.fetchone()
+            # Get the rental_id of the newly inserted entry from the INSERT's own OK packet
+            rental_id = cur.lastrowid
+            log.info("New rental_id is %s", rental_id)
             log.info("Rental entry successfully inserted")
 
+            cur.execute(_SQL_SELECT_RENTAL, (rental_id,))
+            rental = cur.fetchone()
             response = {
                 "statusCode": 200,
-                "headers": response_headers('application/json'),
+                "headers": JSON_HEADERS,
                 "body": json.dumps({
                     "rental_id": rental["rental_id"],
                     "owner_id": rental["owner_id"],
@@ -263,89 +195,110 @@ def create_rental_entry(transactions_conn, event, item_id):
                     "deposit": float(rental["deposit"]),
                     "created_at": rental["created_at"].isoformat(),
                     "updated_at": rental["updated_at"].isoformat()
-                })
+                }, separators=(",", ":"))
             }
-            log.info(f"Response: {response}")
+            log.debug("Response: %s", response)
             return response
     except pymysql.MySQLError as e:
         return {
             "statusCode": 500,
-            "headers": response_headers('text/plain'),
+            "headers": TEXT_HEADERS,
             "body": f"An error occurred while querying the database: {str(e)}"
         }
 
 
 def add_rental(event, context):
-    log.info(event)
+    global _schema_ready
+    log.debug(event)
     item_id = event.get('pathParameters', {}).get('item_id')
     token = event["headers"]["Authorization"]
     clean_token = token.replace("Bearer ", "").strip()
 
-    auth = invoke_auth_lambda(clean_token)
+    # Verify the token in-process rather than paying for a synchronous invoke of the irentstuff-authenticate-user Lambda
+    try:
+        auth = verify_token(clean_token)
+    except Exception as e:
+        log.error("Token verification failed: %s", e)
+        auth = {"message": f"Invalid token: {e}", "username": None}
     auth_result = auth['message']
     requestor = auth['username']
 
-    item_details = get_item(item_id)  # Use the get_item() method to make an API call to the items DB to retrieve item info.
-    item_availability = item_details['availability']
-    item_owner = item_details['owner']
-    log.info(f"Rental requestor: {requestor}, Item owner: {item_owner}. Renting from self: {requestor==item_owner}")
-
+    # Reject bad tokens before spending an items API call on them
     if auth_result != "Token is valid":
         log.error("User token is invalid")
         return {"statusCode": 401,
-                "headers": response_headers('text/plain'),
+                "headers": TEXT_HEADERS,
                 "body": "Your user token is invalid."}
-    elif requestor == item_owner:
+
+    # Parse the body once, up front, so a malformed request is turned away before the items API call
+    try:
+        body = json.loads(event.get("body") or "{}")
+    except ValueError:
+        body = None
+    if not isinstance(body, dict):
+        log.error("Request body is not a JSON object")
+        return {"statusCode": 400,
+                "headers": TEXT_HEADERS,
+                "body": "Request body must be a JSON object."}
+
+    item_details = get_item(item_id)  # Use the get_item() method to make an API call to the items DB to retrieve item info.
+    # get_item() returns {"status_code", "body"} instead of the item when the items API call fails
+    if "status_code" in item_details:
+        log.error("Could not get item %s from the items API: %s %s", item_id, item_details["status_code"], item_details["body"])
+        if item_details["status_code"] == 404:
+            return {"statusCode": 404,
+                    "headers": TEXT_HEADERS,
+                    "body": f"Item {item_id} not found."}
+        return {"statusCode": 502,
+                "headers": TEXT_HEADERS,
+                "body": "Could not retrieve the item details. Please try again."}
+    item_availability = item_details['availability']
+    item_owner = item_details['owner']
+    log.info("Rental requestor: %s, Item owner: %s. Renting from self: %s", requestor, item_owner, requestor == item_owner)
+
+    if requestor == item_owner:
         log.error("Owner cannot rent their own item")
         return {"statusCode": 400,
-                "headers": response_headers('text/plain'),
+                "headers": TEXT_HEADERS,
                 "body": "You cannot rent your own item."}
     else:
         if item_availability == "active_rental":
             return {"statusCode": 400,
-                    "headers": response_headers('text/plain'),
+                    "headers": TEXT_HEADERS,
                     "body": "There are active rentals for this item. You cannot add a new rental."}
         elif item_availability == "pending_purchase":
             return {"statusCode": 400,
-                    "headers": response_headers('text/plain'),
+                    "headers": TEXT_HEADERS,
                     "body": "There are pending purchases for this item. You cannot add a new rental."}
         elif item_availability == "sold":
             return {"statusCode": 400,
-                    "headers": response_headers('text/plain'),
+                    "headers": TEXT_HEADERS,
                     "body": "Item has been sold. To rent out another copy of this item, please create a new entry using the 'Add Stuff' button."}
         elif item_availability == "available":
-            log.info(f"Item ID [{item_id}], is {item_availability}. Confirming in Transactions DB.")
-            transactions_conn = None
+            log.info("Item ID [%s], is %s. Confirming in Transactions DB.", item_id, item_availability)
 
             try:
-                transactions_conn = connect_to_db()
-                create_rental_table(transactions_conn)  # if it doesn't exist
-
-                rentals = check_item_rental_status(transactions_conn, item_id)
-                log.info(rentals)
-
-                content = {
-                    "token": clean_token,
-                    "itemId": item_id,
-                    "ownerid": item_owner,
-                    "renterId": requestor,
-                    "username": requestor
-                }
-
-                message_response = send_message(content)
-                log.info(message_response)
-
-                if rentals["status_code"] != 200:
-                    return {
-                        "statusCode": rentals["status_code"],
-                        "headers": response_headers('application/json'),
-                        "body": json.dumps({
-                            "message": rentals["body"]
-                        })
+                transactions_conn = get_conn()
+                if not _schema_ready:
+                    create_rental_table(transactions_conn)  # if it doesn't exist
+                    _schema_ready = True
+
+                entry = create_rental_entry(transactions_conn, body, item_id)
+                if entry.get("statusCode") == 200:
+                    # The new offer changes the item's state, so don't serve the pre-offer snapshot to the next request
+                    invalidate_item(item_id)
+
+                    content = {
+                        "token": clean_token,
+                        "itemId": item_id,
+                        "ownerid": item_owner,
+                        "renterId": requestor,
+                        "username": requestor
                     }
-                else:
-                    log.info(f"No existing active rentals found for item_id {item_id}. Proceeding to create new rental entry.")
-                    return create_rental_entry(transactions_conn, event, item_id)
+
+                    message_response = send_message(content)
+                    log.info(message_response)
+                return entry
             except Exception as e:
                 log.error(e)
                 return {
@@ -353,6 +306,14 @@ def add_rental(event, context):
                     "headers": {"Content-Type": "text/plain"},
                     "body": f"An error occurred while adding the rental: {e}"
                 }
-            finally:
-                if transactions_conn:
-                    transactions_conn.close()
+
+
+# Provisioned containers run their init ahead of traffic, so open the DB connection and make sure the table exists then
+# instead of on the first request. A failure here is not fatal: the handler connects and creates the table lazily.
+# connect_to_db() calls sys.exit() when it can't connect, so SystemExit is caught too or a DB blip would kill the sandbox
+if os.getenv("AWS_LAMBDA_INITIALIZATION_TYPE") == "provisioned-concurrency":
+    try:
+        create_rental_table(get_conn())
+        _schema_ready = True
+    except (Exception, SystemExit) as e:
+        log.warning("Could not warm up the Transactions DB connection during init: %r", e)
@@ -15,78 +15,37 @@ TODO:
 from datetime import (datetime, date)
 from decimal import Decimal
 
-import boto3
-import sys
 import logging
 import pymysql
 import json
 import os
 import requests
 
+from irentstuff_common.auth import verify_token
+from irentstuff_common.db import get_conn
+from requests.adapters import HTTPAdapter
 from websocket import create_connection
 
 log = logging.getLogger()
-log.setLevel(logging.INFO)
+# WARNING by default: CloudWatch bills per GB ingested and formatting log lines costs CPU on every request.
+# Set LOG_LEVEL=INFO or DEBUG on the function to get the detailed logs back while debugging
+log.setLevel(os.environ.get("LOG_LEVEL", "WARNING"))
 
-lambda_client = boto3.client('lambda', region_name="ap-southeast-1")
+# Shared across warm invocations so the PATCH to the Items API reuses a pooled keep-alive connection instead of a fresh TLS handshake
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
 
-
-def invoke_auth_lambda(jwt_token):
-    # Prepare the payload to send to the authentication Lambda
-    payload = {
-        "headers": {
-            "Authorization": jwt_token
-        }
-    }
-
-    # Invoke the authentication Lambda function
-    response = lambda_client.invoke(
-        FunctionName='irentstuff-authenticate-user',  # Replace with the actual Lambda function name
-        InvocationType='RequestResponse',  # Synchronous invocation
-        Payload=json.dumps(payload)
-    )
-
-    # Read the response from the invoked function
-    response_payload = json.loads(response['Payload'].read())
-    log.info(response_payload)
-
-    # Process the response based on the status code
-    if response['StatusCode'] == 200:
-        # The authentication Lambda responded successfully
-        return json.loads(response_payload.get('body'))
-    else:
-        # Handle the case where the authentication failed
-        raise Exception(f"Authentication failed: {response_payload.get('body')}")
-
-
-def connect_to_db():
-    "Connect to Transactions DB"
-    transactions_conn = None
-    transactions_db_user_name = os.environ["DB1_USER_NAME"]
-    transactions_db_password = os.environ["DB1_PASSWORD"]
-    transactions_db_rds_proxy_host = os.environ["DB1_RDS_PROXY_HOST"]
-    transactions_db_name = os.environ["DB1_NAME"]
-
-    try:
-        transactions_conn = pymysql.connect(
-            host=transactions_db_rds_proxy_host,
-            user=transactions_db_user_name,
-            passwd=transactions_db_password,
-            db=transactions_db_name,
-            connect_timeout=5
-            )
-        log.info("SUCCESS: Connection to Transactions DB succeeded")
-    except pymysql.MySQLError as e:
-        log.error("ERROR: Unexpected error: Could not connect to MySQL instance.")
-        log.error(e)
-        sys.exit(1)
-    return transactions_conn
+# Rendered once per container rather than rebuilding the strings on every request
+_SQL_SELECT_RENTAL = "SELECT * FROM Rentals WHERE rental_id = %s AND item_id = %s"
+_SQL_UPDATE_STATUS = "UPDATE Rentals SET status = %s WHERE rental_id = %s AND item_id = %s"
 
 
 def send_message(content):
     try:
         token = content.get("token")
-        ws = create_connection(f"wss://6z72j61l2b.execute-api.ap-southeast-1.amazonaws.com/dev/?token={token}")
+        # The notification is a nice-to-have on the response path, so a slow handshake or send gives up after 2s
+        # instead of holding the rental update for the socket's default (unbounded) timeout
+        ws = create_connection(f"wss://6z72j61l2b.execute-api.ap-southeast-1.amazonaws.com/dev/?token={token}", timeout=2)
         log.info("WebSocket connection opened")
 
         message = {
@@ -99,11 +58,11 @@ def send_message(content):
             "timestamp": datetime.now().isoformat(),
             "admin": content.get("admin")
         }
-        log.info(json.dumps(message))
-        ws.send(json.dumps(message))
+        payload = json.dumps(message)  # Serialise once for both the log line and the send
+        log.info(payload)
+        ws.send(payload)
         log.info("Message sent")
-        result = ws.recv()
-        log.info("Received '%s'" % result)
+        # Don't wait for the echo: the caller's response doesn't depend on it, and the frame is already on its way
         ws.close()
         log.info("Message successfully sent!")
 
@@ -119,21 +78,28 @@ def send_message(content):
         }
 
 
+_CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, PATCH, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type'
+}
+# Built once per container; callers only read these, so every response can share the same dicts
+_JSON_HEADERS = {**_CORS_HEADERS, 'Content-Type': 'application/json'}
+_TEXT_HEADERS = {**_CORS_HEADERS, 'Content-Type': 'text/plain'}
+
+
 def response_headers(content_type: str):
-    headers = {
-        'Access-Control-Allow-Origin': '*',
-        'Access-Control-Allow-Methods': 'GET, PATCH, OPTIONS',
-        'Access-Control-Allow-Headers': 'Content-Type',
-        'Content-Type': content_type
-    }
-    return headers
+    if content_type == 'application/json':
+        return _JSON_HEADERS
+    if content_type == 'text/plain':
+        return _TEXT_HEADERS
+    return {**_CORS_HEADERS, 'Content-Type': content_type}
 
 
 def get_updated_rental(cursor, item_id, rental_id):
-    retrieve_query = "SELECT * FROM Rentals WHERE item_id = %s AND rental_id = %s"
-    cursor.execute(retrieve_query, (item_id, rental_id))
+    cursor.execute(_SQL_SELECT_RENTAL, (rental_id, item_id))
     rental = cursor.fetchone()
-    log.info(rental)
+    log.debug(rental)
 
     if rental:
         response = {
@@ -156,8 +122,7 @@ def get_updated_rental(cursor, item_id, rental_id):
 
 def update_db(cursor, new_status, rental_id, item_id, transactions_conn):
     # Update the rental status in the DB
-    update_query = "UPDATE Rentals SET status = %s WHERE rental_id = %s AND item_id = %s"
-    cursor.execute(update_query, (new_status, rental_id, item_id))
+    cursor.execute(_SQL_UPDATE_STATUS, (new_status, rental_id, item_id))
     transactions_conn.commit()
 
     # Retrieve and return the updated rental
@@ -165,7 +130,7 @@ def update_db(cursor, new_status, rental_id, item_id, transactions_conn):
 
     return {
         "statusCode": 200,
-        "headers": response_headers('application/json'),
+        "headers": _JSON_HEADERS,
         "body": json.dumps(response)
     }
 
@@ -187,10 +152,10 @@ def update_availability_in_items_db(token, item_id, availability):
 
     try:
         # Make the PATCH request
-        response = requests.patch(api_url, headers=headers, json=payload)
+        response = SESSION.patch(api_url, headers=headers, json=payload, timeout=(3, 5))
 
         if response.status_code == 200:
-            log.info(f"Availability for item {item_id} successfully updated to {availability}")
+            log.info("Availability for item %s successfully updated to %s", item_id, availability)
             return response.json()
         else:
             return {
@@ -206,40 +171,42 @@ def update_availability_in_items_db(token, item_id, availability):
 
 
 def update_rental_status(event, context):
-    transactions_conn = connect_to_db()
-    log.info(event)
+    log.debug(event)
 
-    item_id = event.get("pathParameters", {}).get("item_id")
-    rental_id = event.get("pathParameters", {}).get("rental_id")
-    action = event.get("pathParameters", {}).get("action")  # Accepted actions: "confirm", "start", "cancel", "complete"
-    log.info(f"item_id: {item_id}, rental_id: {rental_id}, action: {action}")
+    path_params = event.get("pathParameters", {})
+    item_id = path_params.get("item_id")
+    rental_id = path_params.get("rental_id")
+    action = path_params.get("action")  # Accepted actions: "confirm", "start", "cancel", "complete"
+    log.info("item_id: %s, rental_id: %s, action: %s", item_id, rental_id, action)
 
     token = event["headers"]["Authorization"]
     clean_token = token.replace("Bearer ", "").strip()
 
-    auth = invoke_auth_lambda(clean_token)
-    log.info(f"{auth=}")
-    auth_result = auth['message']
-    requestor = auth['username']
-    log.info(f"{auth_result=}")
-    log.info(f"{requestor=}")
-
-    if auth_result != "Token is valid":
-        log.error("User token is invalid")
+    # Verified in-process with the layer's verify_token, which also caches accepted tokens (never past their exp),
+    # rather than a synchronous invoke of the irentstuff-authenticate-user Lambda
+    try:
+        auth = verify_token(clean_token)
+    except Exception as e:
+        log.error("Token verification failed: %s", e)
         return {"statusCode": 401,
-                "headers": response_headers('text/plain'),
+                "headers": _TEXT_HEADERS,
                 "body": "Your user token is invalid."}
     else:
+        log.debug("auth=%s", auth)
+        requestor = auth['username']
+
+        # Only fetched once the token checks out, so rejected requests never ping or reopen the RDS Proxy connection.
+        # The layer keeps it open across warm invocations, so it isn't closed here
+        transactions_conn = get_conn()
         try:
             with transactions_conn.cursor(pymysql.cursors.DictCursor) as cursor:
                 # Retrieve the rental by rental_id and item_id
-                log.info(f"rental_id: {rental_id}, item_id: {item_id}")
-                select_query = "SELECT * FROM Rentals WHERE rental_id = %s AND item_id = %s"
-                cursor.execute(select_query, (rental_id, item_id))
+                log.info("rental_id: %s, item_id: %s", rental_id, item_id)
+                cursor.execute(_SQL_SELECT_RENTAL, (rental_id, item_id))
                 rental = cursor.fetchone()
 
                 if rental:
-                    log.info(f"{rental=}")
+                    log.info("rental=%r", rental)
                     item_owner = rental["owner_id"]
                     item_renter = rental["renter_id"]
                     current_status = rental["status"]
@@ -255,7 +222,7 @@ def update_rental_status(event, context):
                     if action == 'confirm' and current_status == 'offered':
                         if requestor == item_owner:
                             new_status = 'confirmed'
-                            log.info(f"Request passed all authentication checks. Item will be {new_status}")
+                            log.info("Request passed all authentication checks. Item will be %s", new_status)
                             db_update = update_db(cursor, new_status, rental_id, item_id, transactions_conn)
 
                             # Send message
@@ -266,14 +233,14 @@ def update_rental_status(event, context):
                         else:
                             log.error("Requestor is not item owner")
                             db_update = {"statusCode": 401,
-                                         "headers": response_headers('text/plain'),
+                                         "headers": _TEXT_HEADERS,
                                          "body": "Only the item owner can confirm the rental request."}
 
                     # Start rental
                     elif action == 'start' and current_status == 'confirmed':
                         if requestor == item_owner:
                             new_status = 'ongoing'
-                            log.info(f"Request passed all authentication checks. Item will be {new_status}")
+                            log.info("Request passed all authentication checks. Item will be %s", new_status)
                             db_update = update_db(cursor, new_status, rental_id, item_id, transactions_conn)
 
                             # Update availability in items DB
@@ -287,14 +254,14 @@ def update_rental_status(event, context):
                         else:
                             log.error("Requestor is not item owner")
                             db_update = {"statusCode": 401,
-                                         "headers": response_headers('text/plain'),
+                                         "headers": _TEXT_HEADERS,
                                          "body": "Only the item owner can start the rental activity."}
 
                     # Cancel rental
                     elif action == 'cancel' and current_status in ('offered', 'confirmed'):
                         if requestor in (item_owner, item_renter):
                             new_status = 'cancelled'
-                            log.info(f"Request passed all authentication checks. Item will be {new_status}")
+                            log.info("Request passed all authentication checks. Item will be %s", new_status)
                             db_update = update_db(cursor, new_status, rental_id, item_id, transactions_conn)
 
                             # Update availability in items DB
@@ -308,14 +275,14 @@ def update_rental_status(event, context):
                         else:
                             log.error("Requestor is not item owner or renter")
                             db_update = {"statusCode": 401,
-                                         "headers": response_headers('text/plain'),
+                                         "headers": _TEXT_HEADERS,
                                          "body": "Only the item owner or renter can cancel the rental request."}
 
                     # Complete rental
                     elif action == 'complete' and current_status == 'ongoing':
                         if requestor == item_owner:
                             new_status = 'completed'
-                            log.info(f"Request passed all authentication checks. Item will be {new_status}")
+                            log.info("Request passed all authentication checks. Item will be %s", new_status)
                             db_update = update_db(cursor, new_status, rental_id, item_id, transactions_conn)
 
                             # Update availability in items DB
@@ -329,26 +296,24 @@ def update_rental_status(event, context):
                         else:
                             log.error("Requestor is not item owner")
                             db_update = {"statusCode": 401,
-                                         "headers": response_headers('text/plain'),
+                                         "headers": _TEXT_HEADERS,
                                          "body": "Only the item owner can complete the rental request."}
                     else:
                         db_update = {
                             "statusCode": 400,
-                            "headers": response_headers('text/plain'),
+                            "headers": _TEXT_HEADERS,
                             "body": f"Cannot perform '{action}' update on Item ID '{item_id}' with Rental ID '{rental_id}' because the current status is '{current_status}'."
                         }
                     return db_update
                 else:
                     return {
                         "statusCode": 404,
-                        "headers": response_headers('text/plain'),
+                        "headers": _TEXT_HEADERS,
                         "body": f"Rental ID {rental_id} with Item ID {item_id} not found."
                     }
         except pymysql.MySQLError as e:
             return {
                 "statusCode": 500,
-                "headers": response_headers('text/plain'),
+                "headers": _TEXT_HEADERS,
                 "body": f"An error occurred while updating the rental status: {str(e)}"
             }
-        finally:
-            transactions_conn.close()
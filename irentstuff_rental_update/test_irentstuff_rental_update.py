@@ -1,7 +1,4 @@
 import json
-import os
-import pymysql
-import pytest
 import requests
 
 from datetime import datetime, date
@@ -10,8 +7,6 @@ from unittest import TestCase
 from unittest.mock import patch, MagicMock
 
 from irentstuff_rental_update import (
-    invoke_auth_lambda,
-    connect_to_db,
     response_headers,
     send_message,
     get_updated_rental,
@@ -21,109 +16,6 @@ from irentstuff_rental_update import (
 )
 
 
-class TestAuthLambda:
-    @patch("irentstuff_rental_update.lambda_client.invoke")
-    def test_invoke_auth_lambda_success(self, mock_invoke):
-        # Mock successful Lambda invocation
-        mock_payload = {
-            'body': json.dumps({"user": "authenticated_user"})
-        }
-        mock_response = {
-            'StatusCode': 200,
-            'Payload': MagicMock(read=MagicMock(return_value=json.dumps(mock_payload)))
-        }
-
-        mock_invoke.return_value = mock_response
-        jwt_token = "test_jwt_token"
-
-        # Call the function
-        result = invoke_auth_lambda(jwt_token)
-
-        # Assertions
-        mock_invoke.assert_called_once_with(
-            FunctionName='irentstuff-authenticate-user',
-            InvocationType='RequestResponse',
-            Payload=json.dumps({
-                "headers": {
-                    "Authorization": jwt_token
-                }
-            })
-        )
-
-        assert result == {"user": "authenticated_user"}
-
-    @patch("irentstuff_rental_update.lambda_client.invoke")
-    def test_invoke_auth_lambda_failure(self, mock_invoke):
-        # Mock failed Lambda invocation
-        mock_response = MagicMock()
-        mock_response['StatusCode'] = 500
-        mock_payload = {
-            'body': json.dumps({"error": "authentication failed"})
-        }
-        mock_response['Payload'].read.return_value = json.dumps(mock_payload)
-
-        mock_invoke.return_value = mock_response
-        jwt_token = "invalid_jwt_token"
-
-        # Call the function and expect it to raise an exception
-        with pytest.raises(Exception) as exc_info:
-            invoke_auth_lambda(jwt_token)
-
-        mock_invoke.assert_called_once_with(
-            FunctionName='irentstuff-authenticate-user',
-            InvocationType='RequestResponse',
-            Payload=json.dumps({
-                "headers": {
-                    "Authorization": jwt_token
-                }
-            })
-        )
-        assert str(exc_info.value) == 'Authentication failed: {"error": "authentication failed"}'
-
-
-class TestConnectToDB(TestCase):
-    @classmethod
-    def setUpClass(cls):
-        # Set up environment variables for testing
-        os.environ["DB1_USER_NAME"] = "test_user"
-        os.environ["DB1_PASSWORD"] = "test_password"
-        os.environ["DB1_RDS_PROXY_HOST"] = "test_host"
-        os.environ["DB1_NAME"] = "test_db"
-
-    @patch("pymysql.connect")
-    def test_connect_to_db_success(self, mock_connect):
-        # Mock the connection object
-        mock_conn = MagicMock()
-        mock_connect.return_value = mock_conn
-
-        # Call the function
-        result = connect_to_db()
-
-        # Assert that the connect function was called with the expected arguments
-        mock_connect.assert_called_once_with(
-            host=os.environ["DB1_RDS_PROXY_HOST"],
-            user=os.environ["DB1_USER_NAME"],
-            passwd=os.environ["DB1_PASSWORD"],
-            db=os.environ["DB1_NAME"],
-            connect_timeout=5
-        )
-
-        # Assert that the returned connection is the mocked connection
-        self.assertEqual(result, mock_conn)
-
-    @patch("pymysql.connect")
-    @patch("sys.exit")  # Mock sys.exit to prevent the script from exiting
-    def test_connect_to_db_failure(self, mock_exit, mock_connect):
-        # Simulate a MySQL error when trying to connect
-        mock_connect.side_effect = pymysql.MySQLError("Connection error")
-
-        # Call the function (no need to expect SystemExit since we're mocking sys.exit)
-        connect_to_db()
-
-        # Assert that sys.exit was called with the correct exit code
-        mock_exit.assert_called_once_with(1)
-
-
 class TestSendMessage(TestCase):
 
     @patch("irentstuff_rental_update.create_connection")  # Mock the WebSocket connection
@@ -132,7 +24,6 @@ class TestSendMessage(TestCase):
         # Arrange
         ws_mock = MagicMock()
         mock_create_connection.return_value = ws_mock
-        ws_mock.recv.return_value = "Success message"  # Mock receiving a WebSocket response
 
         content = {
             "token": "test_token",
@@ -146,12 +37,15 @@ class TestSendMessage(TestCase):
         response = send_message(content)
 
         # Assert
-        mock_create_connection.assert_called_once_with("wss://6z72j61l2b.execute-api.ap-southeast-1.amazonaws.com/dev/?token=test_token")
+        mock_create_connection.assert_called_once_with(
+            "wss://6z72j61l2b.execute-api.ap-southeast-1.amazonaws.com/dev/?token=test_token", timeout=2
+        )
         self.assertEqual(response, {
             "statusCode": 200,
             "body": "WebSocket connection initiated"
         })
         ws_mock.send.assert_called_once()  # Ensure the message was sent
+        ws_mock.recv.assert_not_called()  # The echo is not waited for
         ws_mock.close.assert_called_once()  # Ensure the WebSocket connection was closed
         mock_log.info.assert_called()  # Check that logs were recorded
 
@@ -350,7 +244,7 @@ class TestUpdateDB(TestCase):
 
 class TestUpdateAvailabilityInItemsDB(TestCase):
 
-    @patch("requests.patch")  # Mock the requests.patch method
+    @patch("irentstuff_rental_update.SESSION.patch")  # Mock the pooled session's patch method
     def test_update_availability_success(self, mock_patch):
         token = "valid_token"
         item_id = "item_123"
@@ -365,7 +259,7 @@ class TestUpdateAvailabilityInItemsDB(TestCase):
         # Call the function
         result = update_availability_in_items_db(token, item_id, availability)
 
-        # Verify that requests.patch was called with the correct parameters
+        # Verify that the session PATCH was called with the correct parameters
         api_url = f"https://pxgwc7gdz1.execute-api.ap-southeast-1.amazonaws.com/dev/items/{item_id}"
         expected_headers = {
             "Authorization": f"Bearer {token}",
@@ -373,13 +267,13 @@ class TestUpdateAvailabilityInItemsDB(TestCase):
         }
         expected_payload = {"availability": availability}
 
-        mock_patch.assert_called_once_with(api_url, headers=expected_headers, json=expected_payload)
+        mock_patch.assert_called_once_with(api_url, headers=expected_headers, json=expected_payload, timeout=(3, 5))
 
         # Assert that the result matches the expected response
         expected_result = {"message": "Availability updated"}
         self.assertEqual(result, expected_result)
 
-    @patch("requests.patch")  # Mock the requests.patch method
+    @patch("irentstuff_rental_update.SESSION.patch")  # Mock the pooled session's patch method
     def test_update_availability_failure(self, mock_patch):
         token = "valid_token"
         item_id = "item_123"
@@ -401,7 +295,7 @@ class TestUpdateAvailabilityInItemsDB(TestCase):
         }
         self.assertEqual(result, expected_result)
 
-    @patch("requests.patch")  # Mock the requests.patch method
+    @patch("irentstuff_rental_update.SESSION.patch")  # Mock the pooled session's patch method
     def test_update_availability_request_exception(self, mock_patch):
         token = "valid_token"
         item_id = "item_123"
@@ -423,11 +317,11 @@ class TestUpdateAvailabilityInItemsDB(TestCase):
 
 class TestUpdateRentalStatus(TestCase):
 
-    @patch("irentstuff_rental_update.connect_to_db")  # Mock the database connection
-    @patch("irentstuff_rental_update.invoke_auth_lambda")  # Mock the auth lambda function
+    @patch("irentstuff_rental_update.get_conn")  # Mock the database connection
+    @patch("irentstuff_rental_update.verify_token")
     @patch("irentstuff_rental_update.update_db")  # Mock the update_db function
     @patch("irentstuff_rental_update.update_availability_in_items_db")  # Mock the update_availability_in_items_db function
-    def test_update_rental_status_confirm_success(self, mock_update_availability, mock_update_db, mock_invoke_auth, mock_connect):
+    def test_update_rental_status_confirm_success(self, mock_update_availability, mock_update_db, mock_verify_token, mock_connect):
         # Mock the connection and cursor
         mock_conn = MagicMock()
         mock_cursor = MagicMock()
@@ -435,7 +329,7 @@ class TestUpdateRentalStatus(TestCase):
         mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
 
         # Mock auth response
-        mock_invoke_auth.return_value = {
+        mock_verify_token.return_value = {
             "message": "Token is valid",
             "username": "owner_user"
         }
@@ -472,12 +366,13 @@ class TestUpdateRentalStatus(TestCase):
         # Verify the update_db was called with the correct parameters
         mock_update_db.assert_called_once()
         self.assertEqual(result["statusCode"], 200)
+        mock_conn.close.assert_not_called()  # Kept open for the next warm invocation
 
-    @patch("irentstuff_rental_update.connect_to_db")  # Mock the database connection
-    @patch("irentstuff_rental_update.invoke_auth_lambda")  # Mock the auth lambda function
+    @patch("irentstuff_rental_update.get_conn")  # Mock the database connection
+    @patch("irentstuff_rental_update.verify_token")
     @patch("irentstuff_rental_update.update_db")  # Mock the update_db function
     @patch("irentstuff_rental_update.update_availability_in_items_db")  # Mock the update_availability_in_items_db function
-    def test_update_rental_status_start_success(self, mock_update_availability, mock_update_db, mock_invoke_auth, mock_connect):
+    def test_update_rental_status_start_success(self, mock_update_availability, mock_update_db, mock_verify_token, mock_connect):
         # Mock the connection and cursor
         mock_conn = MagicMock()
         mock_cursor = MagicMock()
@@ -485,7 +380,7 @@ class TestUpdateRentalStatus(TestCase):
         mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
 
         # Mock auth response
-        mock_invoke_auth.return_value = {
+        mock_verify_token.return_value = {
             "message": "Token is valid",
             "username": "owner_user"
         }
@@ -523,11 +418,11 @@ class TestUpdateRentalStatus(TestCase):
         mock_update_db.assert_called_once()
         self.assertEqual(result["statusCode"], 200)
 
-    @patch("irentstuff_rental_update.connect_to_db")  # Mock the database connection
-    @patch("irentstuff_rental_update.invoke_auth_lambda")  # Mock the auth lambda function
+    @patch("irentstuff_rental_update.get_conn")  # Mock the database connection
+    @patch("irentstuff_rental_update.verify_token")
     @patch("irentstuff_rental_update.update_db")  # Mock the update_db function
     @patch("irentstuff_rental_update.update_availability_in_items_db")  # Mock the update_availability_in_items_db function
-    def test_update_rental_status_cancel_success(self, mock_update_availability, mock_update_db, mock_invoke_auth, mock_connect):
+    def test_update_rental_status_cancel_success(self, mock_update_availability, mock_update_db, mock_verify_token, mock_connect):
         # Mock the connection and cursor
         mock_conn = MagicMock()
         mock_cursor = MagicMock()
@@ -535,7 +430,7 @@ class TestUpdateRentalStatus(TestCase):
         mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
 
         # Mock auth response
-        mock_invoke_auth.return_value = {
+        mock_verify_token.return_value = {
             "message": "Token is valid",
             "username": "owner_user"
         }
@@ -573,11 +468,11 @@ class TestUpdateRentalStatus(TestCase):
         mock_update_db.assert_called_once()
         self.assertEqual(result["statusCode"], 200)
 
-    @patch("irentstuff_rental_update.connect_to_db")  # Mock the database connection
-    @patch("irentstuff_rental_update.invoke_auth_lambda")  # Mock the auth lambda function
+    @patch("irentstuff_rental_update.get_conn")  # Mock the database connection
+    @patch("irentstuff_rental_update.verify_token")
     @patch("irentstuff_rental_update.update_db")  # Mock the update_db function
     @patch("irentstuff_rental_update.update_availability_in_items_db")  # Mock the update_availability_in_items_db function
-    def test_update_rental_status_complete_success(self, mock_update_availability, mock_update_db, mock_invoke_auth, mock_connect):
+    def test_update_rental_status_complete_success(self, mock_update_availability, mock_update_db, mock_verify_token, mock_connect):
         # Mock the connection and cursor
         mock_conn = MagicMock()
         mock_cursor = MagicMock()
@@ -585,7 +480,7 @@ class TestUpdateRentalStatus(TestCase):
         mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
 
         # Mock auth response
-        mock_invoke_auth.return_value = {
+        mock_verify_token.return_value = {
             "message": "Token is valid",
             "username": "owner_user"
         }
@@ -623,14 +518,11 @@ class TestUpdateRentalStatus(TestCase):
         mock_update_db.assert_called_once()
         self.assertEqual(result["statusCode"], 200)
 
-    @patch("irentstuff_rental_update.connect_to_db")
-    @patch("irentstuff_rental_update.invoke_auth_lambda")
-    def test_update_rental_status_invalid_token(self, mock_invoke_auth, mock_connect):
-        # Mock auth response
-        mock_invoke_auth.return_value = {
-            "message": "Token is invalid",
-            "username": "user"
-        }
+    @patch("irentstuff_rental_update.get_conn")
+    @patch("irentstuff_rental_update.verify_token")
+    def test_update_rental_status_invalid_token(self, mock_verify_token, mock_connect):
+        # verify_token raises for a bad signature, audience or expiry
+        mock_verify_token.side_effect = Exception("Signature verification failed.")
 
         # Create the event
         event = {
@@ -646,11 +538,12 @@ class TestUpdateRentalStatus(TestCase):
         # Check the response
         self.assertEqual(result["statusCode"], 401)
         self.assertEqual(result["body"], "Your user token is invalid.")
+        mock_connect.assert_not_called()
 
-    @patch("irentstuff_rental_update.connect_to_db")
-    @patch("irentstuff_rental_update.invoke_auth_lambda")
+    @patch("irentstuff_rental_update.get_conn")
+    @patch("irentstuff_rental_update.verify_token")
     @patch("irentstuff_rental_update.update_db")
-    def test_update_rental_status_not_found(self, mock_update_db, mock_invoke_auth, mock_connect):
+    def test_update_rental_status_not_found(self, mock_update_db, mock_verify_token, mock_connect):
         # Mock the connection and cursor
         mock_conn = MagicMock()
         mock_cursor = MagicMock()
@@ -658,7 +551,7 @@ class TestUpdateRentalStatus(TestCase):
         mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
 
         # Mock auth response
-        mock_invoke_auth.return_value = {
+        mock_verify_token.return_value = {
             "message": "Token is valid",
             "username": "owner_user"
         }
@@ -685,10 +578,10 @@ class TestUpdateRentalStatus(TestCase):
         self.assertEqual(result["statusCode"], 404)
         self.assertEqual(result["body"], "Rental ID rental_123 with Item ID item_123 not found.")
 
-    @patch("irentstuff_rental_update.connect_to_db")
-    @patch("irentstuff_rental_update.invoke_auth_lambda")
+    @patch("irentstuff_rental_update.get_conn")
+    @patch("irentstuff_rental_update.verify_token")
     @patch("irentstuff_rental_update.update_db")
-    def test_update_rental_status_permission_denied(self, mock_update_db, mock_invoke_auth, mock_connect):
+    def test_update_rental_status_permission_denied(self, mock_update_db, mock_verify_token, mock_connect):
         # Mock the connection and cursor
         mock_conn = MagicMock()
         mock_cursor = MagicMock()
@@ -696,7 +589,7 @@ class TestUpdateRentalStatus(TestCase):
         mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
 
         # Mock auth response
-        mock_invoke_auth.return_value = {
+        mock_verify_token.return_value = {
             "message": "Token is valid",
             "username": "non_owner_user"
         }
@@ -6,128 +6,111 @@ import json
 import logging
 import pymysql
 import os
-import sys
-from pymysql.cursors import DictCursor
 from datetime import datetime, date
 
+from irentstuff_common.db import get_conn
+
 log = logging.getLogger()
-log.setLevel(logging.INFO)
+# WARNING by default: CloudWatch bills per GB ingested and formatting log lines costs CPU on every request.
+# Set LOG_LEVEL=INFO or DEBUG on the function to get the detailed logs back while debugging
+log.setLevel(os.environ.get("LOG_LEVEL", "WARNING"))
 
+# Rendered once per container rather than rebuilding the strings on every request
+_SQL_SELECT_RENTAL = "SELECT * FROM Rentals WHERE item_id = %s AND rental_id = %s"
+_SQL_SELECT_LATEST_RENTAL = "SELECT * FROM Rentals WHERE item_id = %s ORDER BY created_at DESC LIMIT 1"
+_SQL_SELECT_RENTALS = "SELECT * FROM Rentals WHERE item_id = %s"
 
-def connect_to_db():
-    "Connect to Transactions DB"
-    transactions_conn = None
-    transactions_db_user_name = os.environ["DB1_USER_NAME"]
-    transactions_db_password = os.environ["DB1_PASSWORD"]
-    transactions_db_rds_proxy_host = os.environ["DB1_RDS_PROXY_HOST"]
-    transactions_db_name = os.environ["DB1_NAME"]
 
-    try:
-        transactions_conn = pymysql.connect(
-            host=transactions_db_rds_proxy_host,
-            user=transactions_db_user_name,
-            passwd=transactions_db_password,
-            db=transactions_db_name,
-            connect_timeout=5,
-            cursorclass=DictCursor
-        )
-        log.info("SUCCESS: Connection to Transactions DB succeeded")
-    except pymysql.MySQLError as e:
-        log.error("ERROR: Unexpected error: Could not connect to MySQL instance.")
-        log.error(e)
-        sys.exit(1)
-    return transactions_conn
+_CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type'
+}
+# Built once per container; callers only read these, so every response can share the same dicts
+_JSON_HEADERS = {**_CORS_HEADERS, 'Content-Type': 'application/json'}
+_TEXT_HEADERS = {**_CORS_HEADERS, 'Content-Type': 'text/plain'}
 
 
 def response_headers(content_type: str):
-    headers = {
-        'Access-Control-Allow-Origin': '*',
-        'Access-Control-Allow-Methods': 'GET, OPTIONS',
-        'Access-Control-Allow-Headers': 'Content-Type',
-        'Content-Type': content_type
+    if content_type == 'application/json':
+        return _JSON_HEADERS
+    if content_type == 'text/plain':
+        return _TEXT_HEADERS
+    return {**_CORS_HEADERS, 'Content-Type': content_type}
+
+
+def format_rental(rental):
+    "Turn a Rentals row into JSON-serialisable values: ISO strings for dates and timestamps, floats for prices"
+    return {
+        "rental_id": rental["rental_id"],
+        "owner_id": rental["owner_id"],
+        "renter_id": rental["renter_id"],
+        "item_id": rental["item_id"],
+        "start_date": rental["start_date"].isoformat() if isinstance(rental["start_date"], date) else rental["start_date"],
+        "end_date": rental["end_date"].isoformat() if isinstance(rental["end_date"], date) else rental["end_date"],
+        "status": rental["status"],
+        "price_per_day": float(rental["price_per_day"]) if isinstance(rental["price_per_day"], Decimal) else rental["price_per_day"],
+        "deposit": float(rental["deposit"]) if isinstance(rental["deposit"], Decimal) else rental["deposit"],
+        "created_at": rental["created_at"].isoformat() if isinstance(rental["created_at"], (datetime, date)) else rental["created_at"],
+        "updated_at": rental["updated_at"].isoformat() if isinstance(rental["updated_at"], (datetime, date)) else rental["updated_at"]
     }
-    return headers
 
 
 def retrieve_updated_rental(cursor, item_id, rental_id):
-    retrieve_query = "SELECT * FROM Rentals WHERE item_id = %s AND rental_id = %s"
-    cursor.execute(retrieve_query, (item_id, rental_id))
+    cursor.execute(_SQL_SELECT_RENTAL, (item_id, rental_id))
     rental = cursor.fetchone()
-    log.info(rental)
+    log.debug(rental)
 
     if rental:
-        response = {
-            "rental_id": rental["rental_id"],
-            "owner_id": rental["owner_id"],
-            "renter_id": rental["renter_id"],
-            "item_id": rental["item_id"],
-            "start_date": rental["start_date"].isoformat() if isinstance(rental["start_date"], date) else rental["start_date"],
-            "end_date": rental["end_date"].isoformat() if isinstance(rental["end_date"], date) else rental["end_date"],
-            "status": rental["status"],
-            "price_per_day": float(rental["price_per_day"]) if isinstance(rental["price_per_day"], Decimal) else rental["price_per_day"],
-            "deposit": float(rental["deposit"]) if isinstance(rental["deposit"], Decimal) else rental["deposit"],
-            "created_at": rental["created_at"].isoformat() if isinstance(rental["created_at"], (datetime, date)) else rental["created_at"],
-            "updated_at": rental["updated_at"].isoformat() if isinstance(rental["updated_at"], (datetime, date)) else rental["updated_at"]
-        }
-        return response
+        return format_rental(rental)
     else:
         return {"error": "Rental not found"}
 
 
 def get_rentals(event, context):
-    log.info(event)
-    transactions_conn = None
+    log.debug(event)
 
     path_params = event.get('pathParameters', {})
     item_id = path_params.get('item_id')
     rental_id = path_params.get('rental_id')  # rental_id is not compulsory
-    log.info(f"{item_id=}, {rental_id=}")
+    log.info("item_id=%r, rental_id=%r", item_id, rental_id)
 
     # Get the query type, 'latest' or 'all'. If no query type is provided, defaults to "all"
     query_params = event.get("queryStringParameters", {})
     query_type = query_params.get("type", "all") if query_params else "all"
-    log.info(f"item_id: {item_id}, rental_id: {rental_id}, query_type: {query_type}")
+    log.info("item_id: %s, rental_id: %s, query_type: %s", item_id, rental_id, query_type)
 
     try:
-        transactions_conn = connect_to_db()
+        # The layer's connection is reused across warm invocations, so it isn't closed after the query
+        transactions_conn = get_conn()
         with transactions_conn.cursor(pymysql.cursors.DictCursor) as cursor:
             if rental_id:
                 # Fetch the specific rental by rental_id and item_id
-                select_query = "SELECT * FROM Rentals WHERE item_id = %s AND rental_id = %s"
-                cursor.execute(select_query, (item_id, rental_id))
+                cursor.execute(_SQL_SELECT_RENTAL, (item_id, rental_id))
             elif query_type == 'latest':
-                select_query = """
-                    SELECT * FROM Rentals
-                    WHERE item_id = %s
-                    ORDER BY created_at DESC
-                    LIMIT 1
-                """
-                cursor.execute(select_query, (item_id,))
+                cursor.execute(_SQL_SELECT_LATEST_RENTAL, (item_id,))
             else:
                 # Fetch all rentals for the given item_id
-                select_query = "SELECT * FROM Rentals WHERE item_id = %s"
-                cursor.execute(select_query, (item_id,))
+                cursor.execute(_SQL_SELECT_RENTALS, (item_id,))
 
             rentals = cursor.fetchall()
-            log.info(rentals)
+            log.info("Fetched %d rentals", len(rentals))
 
             # Format the response
             if rentals:
-                response = [retrieve_updated_rental(cursor, rental["item_id"], rental["rental_id"]) for rental in rentals]
+                # Format the rows already fetched rather than reading each one back with its own SELECT
+                response = [format_rental(rental) for rental in rentals]
             else:
                 response = {"message": "No rentals found"}
 
             return {
                 "statusCode": 200,
-                "headers": response_headers('application/json'),
+                "headers": _JSON_HEADERS,
                 "body": json.dumps(response)
             }
     except Exception as e:
         return {
             "statusCode": 500,
-            "headers": response_headers('text/plain'),
+            "headers": _TEXT_HEADERS,
             "body": f"An error occurred while retrieving the rentals: {str(e)}"
         }
-    finally:
-        if transactions_conn:
-            transactions_conn.close()
\ No newline at end of file
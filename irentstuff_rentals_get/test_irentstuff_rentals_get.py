@@ -3,7 +3,7 @@ import json
 import pytest
 from unittest import mock
 from decimal import Decimal
-from irentstuff_rentals_get import connect_to_db, get_rentals, retrieve_updated_rental
+from irentstuff_rentals_get import get_rentals, retrieve_updated_rental
 
 log = getLogger(__name__)
 
@@ -58,8 +58,8 @@ def mock_db_conn(mock_cursor):
 
 
 def test_get_rentals_success(mock_db_conn, mock_cursor, mock_event, mock_context):
-    # Mock connect_to_db to return the mock_db_conn
-    with mock.patch("irentstuff_rentals_get.connect_to_db", return_value=mock_db_conn):
+    # Mock get_conn to return the mock_db_conn
+    with mock.patch("irentstuff_rentals_get.get_conn", return_value=mock_db_conn):
         response = get_rentals(mock_event, mock_context)
         assert response["statusCode"] == 200
         body = json.loads(response["body"])
@@ -67,11 +67,15 @@ def test_get_rentals_success(mock_db_conn, mock_cursor, mock_event, mock_context
         assert body[0]["rental_id"] == "456"
         assert body[0]["price_per_day"] == 10.5
         assert body[0]["deposit"] == 50.0
+        # The fetched rows are formatted as they are, without a SELECT per rental
+        mock_cursor.execute.assert_called_once()
+        mock_cursor.fetchone.assert_not_called()
+        mock_db_conn.close.assert_not_called()  # Kept open for the next warm invocation
 
 
 def test_get_rentals_db_connection_error(mock_event, mock_context):
-    # Mock connect_to_db to raise an exception
-    with mock.patch("irentstuff_rentals_get.connect_to_db", side_effect=Exception("DB connection failed")):
+    # Mock get_conn to raise an exception
+    with mock.patch("irentstuff_rentals_get.get_conn", side_effect=Exception("DB connection failed")):
         response = get_rentals(mock_event, mock_context)
         print("\n\n\nHERE\n\n\n")
         print(f'{response["body"]=}')
@@ -80,8 +84,8 @@ def test_get_rentals_db_connection_error(mock_event, mock_context):
 
 
 def test_get_rentals_no_rentals_found(mock_db_conn, mock_cursor, mock_event, mock_context):
-    # Mock connect_to_db to return the mock_db_conn
-    with mock.patch("irentstuff_rentals_get.connect_to_db", return_value=mock_db_conn):
+    # Mock get_conn to return the mock_db_conn
+    with mock.patch("irentstuff_rentals_get.get_conn", return_value=mock_db_conn):
         # Mock fetchall to return an empty list
         mock_cursor.fetchall.return_value = []
         response = get_rentals(mock_event, mock_context)